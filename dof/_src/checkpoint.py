@@ -5,7 +5,6 @@ import tempfile
 import yaml
 import subprocess
 
-from conda.core.prefix_data import PrefixData
 from rattler import Platform
 from rattler import install as rattler_install
 
@@ -15,16 +14,32 @@ from dof._src.constants import (
 )
 from dof._src.exceptions import DockerBuildFailed
 from dof._src.models import package, environment
-from dof._src.utils import hash_string
+from dof._src.utils import prefix_stat_key, short_uuid
+from dof._src.data.cached import get_data_backend
 from dof._src.data.local import LocalData
+from dof._src.mirror import override_channel, restore_channel
+
+
+def _enum_value(value):
+    # conda stores some record fields as enums, eg. Platform.linux
+    return getattr(value, "value", value)
 
 
 class Checkpoint():
     @classmethod
     def from_prefix(cls, prefix: str, uuid: str, tags: List[str] = []):
+        # conda is slow to import, only pay for it when we scan a prefix
+        from conda.core.prefix_data import PrefixData
+
+        # conda keeps one PrefixData per prefix for the life of the process
+        # and only loads its records once, force a rescan so a long running
+        # process (eg. `dof serve`) sees packages installed since
+        prefix_data = PrefixData(prefix)
+        prefix_data.reload()
+
         packages = []
         channels = set()
-        for prefix_record in PrefixData(prefix).iter_records_sorted():
+        for prefix_record in prefix_data.iter_records_sorted():
             if prefix_record.subdir == "pypi":
                 packages.append(
                     package.PipPackage(
@@ -43,18 +58,22 @@ class Checkpoint():
                         build_number=prefix_record.build_number,
                         subdir=prefix_record.subdir,
                         conda_channel=prefix_record.channel.url(),
-                        # TODO
-                        arch="",
-                        # not sure here
-                        platform="linux-64",
-                        url=prefix_record.url
+                        arch=_enum_value(prefix_record.arch) or "",
+                        platform=_enum_value(prefix_record.platform) or "",
+                        url=prefix_record.url,
+                        md5=getattr(prefix_record, "md5", None),
+                        sha256=getattr(prefix_record, "sha256", None),
+                        size=getattr(prefix_record, "size", None),
+                        depends=list(prefix_record.depends),
+                        constrains=list(prefix_record.constrains),
+                        noarch=_enum_value(prefix_record.noarch),
                     )
                 )
 
         env_metadata = environment.EnvironmentMetadata(
             platform = str(Platform.current()),
             channels = channels,
-            build_hash = hash_string(str(packages)),
+            build_hash = package.fingerprint(packages),
         )
         env_spec = environment.EnvironmentSpec(
             packages=packages,
@@ -70,7 +89,7 @@ class Checkpoint():
 
     @classmethod
     def from_uuid(cls, prefix: str, uuid: str):
-        data_dir = LocalData()
+        data_dir = get_data_backend()
         env_checkpoint = data_dir.get_environment_checkpoint(prefix, uuid)
         return cls(env_checkpoint=env_checkpoint, prefix=prefix)
 
@@ -79,18 +98,35 @@ class Checkpoint():
         env_checkpoint = environment.EnvironmentCheckpoint.model_validate(checkpoint_data)
         return cls(env_checkpoint=env_checkpoint, prefix=prefix)
     
+    @classmethod
+    def from_lockfile_dict(cls, lock_data: Dict, prefix: str):
+        """A new checkpoint for a lockfile generated by `dof lock`"""
+        env_spec = environment.EnvironmentSpec.model_validate(lock_data)
+        uuid = short_uuid()
+        env_checkpoint = environment.EnvironmentCheckpoint(
+            environment=env_spec,
+            timestamp=str(datetime.datetime.now(datetime.UTC)),
+            uuid=uuid,
+            tags=[uuid],
+        )
+        return cls(env_checkpoint=env_checkpoint, prefix=prefix)
+
     def __init__(self, env_checkpoint: environment.EnvironmentCheckpoint, prefix: str):
         self.env_checkpoint = env_checkpoint
         self.prefix = prefix
-        # TODO: this can be swapped out for a different data 
-        # dir type, eg to support remote data dirs
-        self.data_dir = LocalData()
+        # channel to download the packages from instead, see `with_channel`
+        self.channel_override = None
+        # local unless a remote is configured, see `get_data_backend`
+        self.data_dir = get_data_backend()
 
     def save(self):
         self.data_dir.save_environment_checkpoint(self.env_checkpoint, self.prefix)
 
     def diff(self, revision: str):
         target_checkpoint = self.data_dir.get_environment_checkpoint(self.prefix, uuid=revision)
+        return self.diff_checkpoint(target_checkpoint)
+
+    def diff_checkpoint(self, target_checkpoint: environment.EnvironmentCheckpoint):
         target_packages = target_checkpoint.environment.packages
         current_packages = self.env_checkpoint.environment.packages
 
@@ -99,18 +135,42 @@ class Checkpoint():
 
         return packages_in_current_not_in_target, packages_in_target_not_in_current
 
+    def with_channel(self, channel_url: str):
+        """A copy of this checkpoint that downloads its packages from another channel
+
+        The installed prefix still records the original package urls, so
+        it matches this checkpoint.
+        """
+        chck = Checkpoint(env_checkpoint=self.env_checkpoint, prefix=self.prefix)
+        chck.channel_override = channel_url
+        return chck
+
+    def _packages_to_install(self) -> List[package.Package]:
+        packages = self.env_checkpoint.environment.packages
+        if self.channel_override is None:
+            return packages
+        return override_channel(packages, self.channel_override)
+
+    def _restore_channel(self):
+        if self.channel_override is not None:
+            restore_channel(self.prefix, self.env_checkpoint.environment.packages)
+
     def list_packages(self):
         return self.env_checkpoint.environment.packages
 
+    def fingerprint(self) -> str:
+        return self.env_checkpoint.environment.fingerprint()
+
     async def install_with_rattler(self):
         # WARNING: DOES NOT WORK FOR PIP OR IF YOU HAVE PIP PACKAGES IN YOUR ENV
-        repodata_records = [pkg.to_repodata_record() for pkg in self.env_checkpoint.environment.packages]
+        repodata_records = [pkg.to_repodata_record() for pkg in self._packages_to_install()]
         repodata_records = [pkg for pkg in repodata_records if pkg is not None]
         await rattler_install(
             repodata_records,
             target_prefix=self.prefix,
             execute_link_scripts=True,
         )
+        self._restore_channel()
         # ensure that the history file exists. This let's conda know that it's a real 
         # environment. If it doesn't exist, create it
         history_file = f"{self.prefix}/conda-meta/history"
@@ -118,6 +178,30 @@ class Checkpoint():
             with open(history_file, "w") as f:
                 f.write("# history file created with dof")
 
+    def clone_to(self, target_prefix: str) -> Dict[str, int]:
+        """Materialize this checkpoint into a new prefix, see `clone_checkpoint`"""
+        # pulls in conda's linking machinery, only import when cloning
+        from dof._src.clone import clone_checkpoint
+
+        return clone_checkpoint(
+            self.env_checkpoint, target_prefix, source_prefixes=[self.prefix],
+        )
+
+    def install_with_pipeline(self, summary_file: str | None = None) -> Dict:
+        """Install into a new prefix with the streaming install pipeline
+
+        Unlike `install_with_rattler` this doesn't remove anything already
+        in the prefix. Optionally writes a json summary of the install.
+        """
+        # pulls in conda's linking machinery, only import when installing
+        from dof._src.install import InstallPipeline, write_summary
+
+        summary = InstallPipeline(self.prefix, self._packages_to_install()).run()
+        self._restore_channel()
+        if summary_file is not None:
+            write_summary(summary, summary_file)
+        return summary
+
     def to_docker(self, base_image: str = DEFAULT_DOCKER_EXPORT_BASE_IMAGE) -> tuple[str, list[str]]:
         assets_dir = tempfile.mkdtemp()
 
@@ -147,3 +231,25 @@ class Checkpoint():
             )
 
         return assets_dir, tags
+
+
+def prefix_fingerprint(prefix: str, data_dir: LocalData | None = None) -> str:
+    """Fingerprint of the packages currently installed in a prefix
+
+    Scanning a prefix is expensive, so the result is cached against a
+    stat of the prefix metadata and only recomputed when that changes.
+    The cache is always kept in the local data dir.
+    """
+    if data_dir is None:
+        data_dir = LocalData()
+
+    stat_key = prefix_stat_key(prefix)
+    cache = data_dir.get_status_cache(prefix)
+    if cache is not None and cache.get("stat_key") == stat_key:
+        return cache["build_hash"]
+
+    chck = Checkpoint.from_prefix(prefix=prefix, uuid="")
+    build_hash = chck.env_checkpoint.environment.metadata.build_hash
+    data_dir.save_status_cache(prefix, stat_key, build_hash)
+    return build_hash
+
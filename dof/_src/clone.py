@@ -0,0 +1,414 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+import contextlib
+import json
+import os
+import shutil
+import tempfile
+import warnings
+
+from conda.base.context import context
+from conda.core.envs_manager import list_all_known_prefixes
+from conda.core.package_cache_data import PackageCacheData
+from conda.core.portability import update_prefix
+from conda.models.enums import FileMode
+from conda_package_handling import api as cph_api
+
+from dof._src.fetch import dist_name, download_file, file_digest, record_matches, verify_package
+from dof._src.models import environment, package
+from dof._src.utils import ensure_dir
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - windows
+    fcntl = None
+
+
+# linux ioctl to share the extents of a file (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+# how conda records the scripts it generates for noarch: python entry points
+ENTRY_POINT_PATH_TYPE = "unix_python_entry_point"
+
+DEFAULT_CLONE_WORKERS = 8
+
+ENTRY_POINT_TEMPLATE = """#!{python}
+# -*- coding: utf-8 -*-
+import re
+import sys
+
+from {module} import {import_name}
+
+if __name__ == '__main__':
+    sys.argv[0] = re.sub(r'(-script\\.pyw?|\\.exe)?$', '', sys.argv[0])
+    sys.exit({func}())
+"""
+
+
+class PackageSource:
+    """Where the files of a package can be linked from
+
+    `root` is either an extracted package in a package cache or a prefix
+    that already has the package installed. For a prefix the files with a
+    prefix placeholder already contain `placeholder_prefix` instead.
+    """
+
+    def __init__(self, url: str, root: str, paths: List[Dict], record: Dict, placeholder_prefix: str | None = None):
+        self.url = url
+        self.root = root
+        self.paths = paths
+        self.record = record
+        self.placeholder_prefix = placeholder_prefix
+
+    @property
+    def from_prefix(self) -> bool:
+        return self.placeholder_prefix is not None
+
+    @property
+    def is_noarch_python(self) -> bool:
+        noarch = self.record.get("noarch")
+        if isinstance(noarch, dict):
+            noarch = noarch.get("type")
+        return noarch == "python"
+
+
+def cache_source(pkg: package.Package, pkgs_dirs: List[str]) -> PackageSource | None:
+    """Find an extracted copy of a package in the package caches
+
+    Only an entry recorded with the same checksum is a hit, see
+    `record_matches`.
+    """
+    url = pkg.url
+    dist = dist_name(url)
+    for pkgs_dir in pkgs_dirs:
+        extracted = os.path.join(pkgs_dir, dist)
+        paths_file = os.path.join(extracted, "info", "paths.json")
+        if not os.path.isfile(paths_file):
+            continue
+        with open(paths_file) as file:
+            paths = json.load(file)["paths"]
+        record_file = os.path.join(extracted, "info", "repodata_record.json")
+        if not os.path.isfile(record_file):
+            record_file = os.path.join(extracted, "info", "index.json")
+        with open(record_file) as file:
+            record = json.load(file)
+        if not record_matches(pkg, record):
+            continue
+        link_file = os.path.join(extracted, "info", "link.json")
+        if os.path.isfile(link_file):
+            with open(link_file) as file:
+                record["link_json"] = json.load(file)
+        return PackageSource(url, extracted, paths, record)
+    return None
+
+
+def _prefix_source(pkg: package.Package, prefixes: List[str], site_packages: str | None) -> PackageSource | None:
+    url = pkg.url
+    meta_name = f"{dist_name(url)}.json"
+    for prefix in prefixes:
+        meta_file = os.path.join(prefix, "conda-meta", meta_name)
+        if not os.path.isfile(meta_file):
+            continue
+        with open(meta_file) as file:
+            record = json.load(file)
+        if record.get("url") != url or not record_matches(pkg, record):
+            continue
+        paths = record.get("paths_data", {}).get("paths", [])
+        if not paths:
+            continue
+        # binary placeholders can only be replaced by a prefix that is
+        # not longer than the one they hold, use a cache copy instead
+        if any(p.get("prefix_placeholder") and p.get("file_mode") == "binary" for p in paths):
+            continue
+        source = PackageSource(url, prefix, paths, record, placeholder_prefix=prefix)
+        # noarch: python files are relocated for the python of that prefix
+        if site_packages is not None and source.is_noarch_python:
+            if not any(p["_path"].startswith(site_packages) for p in paths):
+                continue
+        # the records of a live prefix can be out of date, eg. files deleted
+        # by pip. Missing .pyc files are fine, python writes them again.
+        existing, missing = [], []
+        for p in paths:
+            (existing if os.path.lexists(os.path.join(prefix, p["_path"])) else missing).append(p)
+        if any(p.get("path_type") != "pyc_file" for p in missing):
+            continue
+        source.paths = existing
+        return source
+    return None
+
+
+def download_package(pkg: package.Package, pkgs_dir: str) -> str:
+    """Download a package into a private work dir inside a package cache"""
+    work_dir = tempfile.mkdtemp(dir=pkgs_dir, prefix=f".{dist_name(pkg.url)}.")
+    tarball = os.path.join(work_dir, pkg.url.split("/")[-1])
+    download_file(pkg.url, tarball)
+    return tarball
+
+
+def _write_repodata_record(pkg: package.Package, tarball: str, extracted: str):
+    """Record where an extracted package came from and its checksums
+
+    conda_package_handling only extracts the files, without this the
+    cache entry couldn't be matched by checksum later.
+    """
+    info_dir = os.path.join(extracted, "info")
+    with open(os.path.join(info_dir, "index.json")) as file:
+        record = json.load(file)
+    file_name = os.path.basename(tarball)
+    record.update(
+        url=pkg.url,
+        channel=pkg.url.rsplit("/", 2)[0],
+        fn=file_name,
+        # the tarball has been verified against what is recorded
+        md5=pkg.md5 or file_digest(tarball, "md5"),
+        sha256=pkg.sha256 or file_digest(tarball, "sha256"),
+        size=os.path.getsize(tarball),
+    )
+    with open(os.path.join(info_dir, "repodata_record.json"), "w") as file:
+        json.dump(record, file, indent=2)
+
+
+def extract_package(pkg: package.Package, tarball: str, pkgs_dir: str) -> PackageSource:
+    """Extract a verified package into the package cache"""
+    dist = dist_name(pkg.url)
+    work_dir = os.path.dirname(tarball)
+    target = os.path.join(pkgs_dir, dist)
+    try:
+        extracted = os.path.join(work_dir, dist)
+        cph_api.extract(tarball, dest_dir=extracted)
+        if not os.path.isfile(os.path.join(extracted, "info", "paths.json")):
+            raise ValueError(f"{pkg.url} is not a valid conda package, no info/paths.json")
+        _write_repodata_record(pkg, tarball, extracted)
+        try:
+            os.rename(extracted, target)
+        except OSError:
+            # either another process extracted it in the meantime, or the
+            # cache holds a different artifact with the same name
+            if cache_source(pkg, [pkgs_dir]) is None:
+                stale = os.path.join(work_dir, f"{dist}.stale")
+                os.rename(target, stale)
+                os.rename(extracted, target)
+        cached_tarball = os.path.join(pkgs_dir, os.path.basename(tarball))
+        if not os.path.exists(cached_tarball):
+            with contextlib.suppress(OSError):
+                os.rename(tarball, cached_tarball)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    source = cache_source(pkg, [pkgs_dir])
+    if source is None:
+        raise ValueError(f"failed to add {pkg.url} to the package cache {pkgs_dir}")
+    return source
+
+
+def _fetch(pkg: package.Package, pkgs_dir: str) -> PackageSource:
+    """Download, verify and extract a package into a package cache"""
+    tarball = download_package(pkg, pkgs_dir)
+    try:
+        verify_package(pkg, tarball)
+    except ValueError:
+        shutil.rmtree(os.path.dirname(tarball), ignore_errors=True)
+        raise
+    return extract_package(pkg, tarball, pkgs_dir)
+
+
+def _reflink_or_copy(src: str, dst: str):
+    if fcntl is not None:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                shutil.copymode(src, dst)
+                return
+            except OSError:
+                pass
+    shutil.copy2(src, dst)
+
+
+def _link_file(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # eg. the cache and target are on different filesystems
+        _reflink_or_copy(src, dst)
+
+
+class PackageLinker:
+    def __init__(self, target_prefix: str, python_version: str | None):
+        self.target_prefix = target_prefix
+        self.site_packages = None
+        self.python = None
+        if python_version is not None:
+            self.site_packages = f"lib/python{python_version}/site-packages"
+            self.python = os.path.join(target_prefix, "bin", "python")
+
+    def _target_path(self, source: PackageSource, path: str) -> str:
+        if source.from_prefix or not source.is_noarch_python:
+            return path
+        if path.startswith("site-packages/"):
+            return f"{self.site_packages}/{path[len('site-packages/'):]}"
+        if path.startswith("python-scripts/"):
+            return f"bin/{path[len('python-scripts/'):]}"
+        return path
+
+    def _write_entry_points(self, source: PackageSource) -> List[str]:
+        noarch = source.record.get("link_json", {}).get("noarch", {})
+        written = []
+        for entry_point in noarch.get("entry_points", []):
+            name, target = (part.strip() for part in entry_point.split("="))
+            module, func = target.split(":")
+            path = f"bin/{name}"
+            dst = os.path.join(self.target_prefix, path)
+            ensure_dir(os.path.dirname(dst))
+            with open(dst, "w") as file:
+                file.write(ENTRY_POINT_TEMPLATE.format(
+                    python=self.python,
+                    module=module,
+                    import_name=func.split(".")[0],
+                    func=func,
+                ))
+            os.chmod(dst, 0o755)
+            written.append(path)
+        return written
+
+    def link(self, source: PackageSource):
+        if source.is_noarch_python and not source.from_prefix and self.site_packages is None:
+            raise ValueError(f"can't install noarch: python package {source.url} without python")
+
+        paths = []
+        for entry in source.paths:
+            path = self._target_path(source, entry["_path"])
+            src = os.path.join(source.root, entry["_path"])
+            dst = os.path.join(self.target_prefix, path)
+            path_type = entry.get("path_type", "hardlink")
+
+            if path_type == "directory":
+                ensure_dir(dst)
+                paths.append({**entry, "_path": path})
+                continue
+            ensure_dir(os.path.dirname(dst))
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(dst)
+
+            if path_type == "softlink":
+                os.symlink(os.readlink(src), dst)
+            elif entry.get("prefix_placeholder") or (
+                # generated entry points have the shebang of the python in
+                # their prefix but no placeholder recorded
+                source.from_prefix and path_type == ENTRY_POINT_PATH_TYPE
+            ):
+                # the only files that need their own copy
+                shutil.copy2(src, dst)
+                if source.from_prefix:
+                    placeholder = source.placeholder_prefix
+                    mode = FileMode.text
+                else:
+                    placeholder = entry["prefix_placeholder"]
+                    mode = FileMode(entry.get("file_mode", "text"))
+                update_prefix(dst, self.target_prefix, placeholder, mode)
+            elif entry.get("no_link"):
+                shutil.copy2(src, dst)
+            else:
+                _link_file(src, dst)
+            paths.append({**entry, "_path": path})
+
+        if source.is_noarch_python and not source.from_prefix:
+            for path in self._write_entry_points(source):
+                paths.append({"_path": path, "path_type": ENTRY_POINT_PATH_TYPE})
+
+        self._write_conda_meta(source, paths)
+
+    def _write_conda_meta(self, source: PackageSource, paths: List[Dict]):
+        record = {k: v for k, v in source.record.items() if k != "link_json"}
+        record.update(
+            url=source.url,
+            fn=source.url.split("/")[-1],
+            channel=source.url.rsplit("/", 2)[0],
+            files=[p["_path"] for p in paths],
+            paths_data={"paths": paths, "paths_version": 1},
+            link={"source": source.root, "type": 1},
+        )
+        record.setdefault("requested_spec", "")
+        meta_dir = os.path.join(self.target_prefix, "conda-meta")
+        ensure_dir(meta_dir)
+        with open(os.path.join(meta_dir, f"{dist_name(source.url)}.json"), "w") as file:
+            json.dump(record, file, indent=2)
+
+
+def find_python_version(packages: List[package.Package]) -> str | None:
+    for pkg in packages:
+        if isinstance(pkg, package.PipPackage):
+            continue
+        dist = dist_name(pkg.url)
+        name, version = "-".join(dist.split("-")[:-2]), dist.split("-")[-2]
+        if name == "python":
+            return ".".join(version.split(".")[:2])
+    return None
+
+
+def clone_checkpoint(
+    env_checkpoint: environment.EnvironmentCheckpoint,
+    target_prefix: str,
+    source_prefixes: List[str] | None = None,
+    max_workers: int = DEFAULT_CLONE_WORKERS,
+) -> Dict[str, int]:
+    """Materialize a checkpoint into a new prefix without a full install
+
+    Package files are hardlinked (reflinked or copied across filesystems)
+    from the conda package caches or from other prefixes with the same
+    package installed, only files with a prefix placeholder are copied
+    and rewritten. Packages found in neither place are downloaded into
+    the first writable package cache in parallel. Link scripts are not
+    run and pip packages are skipped.
+
+    Returns how many packages came from each kind of source.
+    """
+    packages = env_checkpoint.environment.packages
+    conda_packages = [pkg for pkg in packages if not isinstance(pkg, package.PipPackage)]
+    if len(conda_packages) != len(packages):
+        warnings.warn("pip packages are not cloned")
+
+    if source_prefixes is None:
+        source_prefixes = []
+    source_prefixes = [p for p in source_prefixes + list_all_known_prefixes() if p != target_prefix]
+
+    python_version = find_python_version(conda_packages)
+    linker = PackageLinker(target_prefix, python_version)
+    pkgs_dirs = list(context.pkgs_dirs)
+
+    sources = {}
+    missing = []
+    summary = {"cache": 0, "prefix": 0, "fetched": 0}
+    for pkg in conda_packages:
+        source = cache_source(pkg, pkgs_dirs)
+        if source is not None:
+            summary["cache"] += 1
+        else:
+            source = _prefix_source(pkg, source_prefixes, linker.site_packages)
+            if source is not None:
+                summary["prefix"] += 1
+        if source is None:
+            missing.append(pkg)
+        else:
+            sources[pkg.url] = source
+
+    ensure_dir(target_prefix)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(linker.link, source) for source in sources.values()]
+        if missing:
+            pkgs_dir = PackageCacheData.first_writable().pkgs_dir
+            # each missing package is linked as soon as it is extracted
+            futures += [
+                executor.submit(lambda p: linker.link(_fetch(p, pkgs_dir)), pkg)
+                for pkg in missing
+            ]
+            summary["fetched"] = len(missing)
+        for future in futures:
+            # re-raises any errors from the workers
+            future.result()
+
+    history_file = os.path.join(target_prefix, "conda-meta", "history")
+    if not os.path.isfile(history_file):
+        with open(history_file, "w") as f:
+            f.write("# history file created with dof")
+
+    return summary
@@ -21,3 +21,8 @@ ENV PATH=/usr/local/env/bin:${PATH}
 
 class SupportedExportFormats(str, Enum):
     DOCKER = "docker"
+
+
+class InstallEngines(str, Enum):
+    PIPELINE = "pipeline"
+    RATTLER = "rattler"
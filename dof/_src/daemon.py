@@ -0,0 +1,165 @@
+# `dof serve` daemon and its client, speaks newline delimited JSON-RPC 2.0
+# over a unix socket. Only the standard library is imported at the top so
+# that talking to a running daemon stays cheap.
+import itertools
+import json
+import os
+import socket
+import socketserver
+import traceback
+from pathlib import Path
+
+from dof._src.exceptions import DaemonError
+
+
+# methods of `DofService` that are exposed over rpc
+RPC_METHODS = {"save", "delete", "list", "diff", "show", "status", "push", "pull"}
+
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+METHOD_NOT_FOUND = -32601
+SERVER_ERROR = -32000
+
+
+def default_socket_path() -> str:
+    socket_path = os.environ.get("DOF_SOCKET", None)
+    if socket_path is not None:
+        return socket_path
+    dof_dir = os.environ.get("DOF_DIR", None)
+    if dof_dir is None:
+        dof_dir = Path.home() / ".dof"
+    return str(Path(dof_dir) / "dof.sock")
+
+
+class DaemonClient:
+    """Calls `DofService` methods on a running `dof serve`"""
+
+    def __init__(self, sock: socket.socket):
+        self._sock = sock
+        self._file = sock.makefile("rwb")
+        self._ids = itertools.count(1)
+
+    @classmethod
+    def connect(cls, socket_path: str | None = None) -> "DaemonClient | None":
+        """Connect to the daemon, returns None if it isn't running"""
+        if socket_path is None:
+            socket_path = default_socket_path()
+        if not os.path.exists(socket_path):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            sock.close()
+            return None
+        return cls(sock)
+
+    def call(self, method: str, **params):
+        request = {"jsonrpc": "2.0", "id": next(self._ids), "method": method, "params": params}
+        self._file.write(json.dumps(request).encode("utf-8") + b"\n")
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise DaemonError("connection closed by daemon")
+        response = json.loads(line)
+        if "error" in response:
+            raise DaemonError(response["error"]["message"])
+        return response["result"]
+
+    def __getattr__(self, method: str):
+        if method not in RPC_METHODS:
+            raise AttributeError(method)
+        return lambda **params: self.call(method, **params)
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+def get_service():
+    """A running daemon if there is one, otherwise an in-process service
+
+    Set `DOF_NO_DAEMON` to always run in-process.
+    """
+    if not os.environ.get("DOF_NO_DAEMON"):
+        client = DaemonClient.connect()
+        if client is not None:
+            return client
+
+    from dof._src.service import DofService
+    return DofService()
+
+
+def _handle_request(service, line: bytes) -> dict:
+    try:
+        request = json.loads(line)
+        request_id = request.get("id")
+        method = request["method"]
+        params = request.get("params", {})
+    except (ValueError, KeyError, AttributeError) as e:
+        return {"jsonrpc": "2.0", "id": None, "error": {"code": PARSE_ERROR, "message": str(e)}}
+
+    if method not in RPC_METHODS:
+        return {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "error": {"code": METHOD_NOT_FOUND, "message": f"unknown method `{method}`"},
+        }
+
+    try:
+        result = getattr(service, method)(**params)
+    except Exception as e:
+        traceback.print_exc()
+        return {"jsonrpc": "2.0", "id": request_id, "error": {"code": SERVER_ERROR, "message": str(e)}}
+    return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = _handle_request(self.server.service, line)
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, service):
+        self.service = service
+        super().__init__(socket_path, _RequestHandler)
+
+
+def serve(socket_path: str | None = None):
+    """Serve `DofService` on a unix socket until interrupted"""
+    from dof._src.service import DofService
+
+    if socket_path is None:
+        socket_path = default_socket_path()
+    Path(socket_path).parent.mkdir(parents=True, exist_ok=True)
+
+    if os.path.exists(socket_path):
+        client = DaemonClient.connect(socket_path)
+        if client is not None:
+            client.close()
+            raise DaemonError(f"a daemon is already listening on {socket_path}")
+        # left behind by a daemon that didn't shut down cleanly
+        os.remove(socket_path)
+
+    # only the current user may talk to the daemon
+    old_umask = os.umask(0o077)
+    try:
+        server = _Server(socket_path, DofService())
+    finally:
+        os.umask(old_umask)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
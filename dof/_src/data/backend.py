@@ -0,0 +1,45 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List
+
+from dof._src.models import environment
+
+
+class DataBackend(ABC):
+    """Storage for environment checkpoints
+
+    Checkpoints are grouped by the prefix they were taken from and
+    addressed by their uuid.
+    """
+
+    @abstractmethod
+    def delete_environment_checkpoint(self, prefix: str, uuid: str):
+        ...
+
+    @abstractmethod
+    def save_environment_checkpoint(self, checkpoint: environment.EnvironmentCheckpoint, prefix: str):
+        ...
+
+    def save_environment_checkpoints(self, checkpoints: List[environment.EnvironmentCheckpoint], prefix: str):
+        """Save a batch of checkpoints, backends can override this to batch writes"""
+        for checkpoint in checkpoints:
+            self.save_environment_checkpoint(checkpoint, prefix)
+
+    @abstractmethod
+    def list_checkpoint_uuids(self, prefix: str) -> List[str]:
+        """List the uuids of the checkpoints for a prefix without loading them"""
+        ...
+
+    def get_checkpoint_index(self, prefix: str) -> Dict[str, Dict]:
+        """uuid -> `EnvironmentCheckpoint.index_entry` for every checkpoint of a prefix
+
+        Backends should override this to avoid loading every checkpoint.
+        """
+        return {c.uuid: c.index_entry() for c in self.get_environment_checkpoints(prefix)}
+
+    @abstractmethod
+    def get_environment_checkpoints(self, prefix: str) -> List[environment.EnvironmentCheckpoint]:
+        ...
+
+    @abstractmethod
+    def get_environment_checkpoint(self, prefix: str, uuid: str) -> environment.EnvironmentCheckpoint | None:
+        ...
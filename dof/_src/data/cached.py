@@ -0,0 +1,299 @@
+from typing import Dict, Iterable, List
+import atexit
+import contextlib
+import functools
+import json
+import os
+import queue
+import threading
+import time
+import warnings
+
+from dof._src.data.backend import DataBackend
+from dof._src.data.local import LocalData
+from dof._src.data.remote import FilesystemRemoteData
+from dof._src.models import environment
+from dof._src.utils import atomic_write, ensure_dir
+
+
+# max number of checkpoints per environment to keep in the local cache
+DEFAULT_CACHE_SIZE = 100
+# marks a checkpoint that has been saved locally but not uploaded yet,
+# the marker file contains the prefix so it can be retried later
+PENDING_MARKER_PREFIX = ".pending-"
+# local copy of the remote checkpoint index, see `CachedData.index_ttl`
+REMOTE_INDEX_FILE_NAME = ".remote-index"
+# seconds a copy of the remote index is trusted before it is refetched
+DEFAULT_INDEX_TTL = 60.0
+
+
+class CachedData(DataBackend):
+    """A local write-through cache in front of a remote backend
+
+    Saves land in the local data dir right away and are uploaded to the
+    remote in batches by a background thread. Reads are served locally
+    when possible and only fall back to the remote on a miss. Listing
+    uses the remote checkpoint index, a local copy of it is reused for
+    `index_ttl` seconds. After each upload the local cache is
+    trimmed to `max_entries` checkpoints per environment, least recently
+    used first, but only checkpoints that are already on the remote are
+    ever evicted. Reads never evict.
+    """
+
+    def __init__(
+        self,
+        local: LocalData,
+        remote: DataBackend,
+        max_entries: int = DEFAULT_CACHE_SIZE,
+        batch_delay: float = 0.5,
+        batch_size: int = 64,
+        index_ttl: float = DEFAULT_INDEX_TTL,
+    ):
+        self.local = local
+        self.remote = remote
+        self.max_entries = max_entries
+        self.batch_delay = batch_delay
+        self.batch_size = batch_size
+        self.index_ttl = index_ttl
+
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def _checkpoint_file(self, prefix: str, uuid: str) -> str:
+        return os.path.join(self.local._get_env_dir(prefix), uuid)
+
+    def _marker_file(self, prefix: str, uuid: str) -> str:
+        return os.path.join(self.local._get_env_dir(prefix), f"{PENDING_MARKER_PREFIX}{uuid}")
+
+    def _touch(self, prefix: str, uuid: str):
+        # the mtime of the cached file doubles as its last access time
+        with contextlib.suppress(OSError):
+            os.utime(self._checkpoint_file(prefix, uuid))
+
+    def _is_pending(self, prefix: str, uuid: str) -> bool:
+        return os.path.exists(self._marker_file(prefix, uuid))
+
+    def _evict(self, prefix: str):
+        """Trim the local cache of a prefix, only called by the upload worker"""
+        uuids = self.local.list_checkpoint_uuids(prefix)
+        if len(uuids) <= self.max_entries:
+            return
+
+        # never drop the only copy of a checkpoint
+        remote_uuids = set(self.remote.list_checkpoint_uuids(prefix))
+        candidates = []
+        for uuid in uuids:
+            if uuid not in remote_uuids or self._is_pending(prefix, uuid):
+                continue
+            try:
+                mtime = os.stat(self._checkpoint_file(prefix, uuid)).st_mtime_ns
+            except OSError:
+                continue
+            candidates.append((mtime, uuid))
+
+        candidates.sort()
+        for _, uuid in candidates[:len(uuids) - self.max_entries]:
+            self.local.delete_environment_checkpoint(prefix, uuid)
+
+    def _remote_index_file(self, prefix: str) -> str:
+        return os.path.join(self.local._get_env_dir(prefix), REMOTE_INDEX_FILE_NAME)
+
+    def _remote_index(self, prefix: str, refresh: bool = False) -> Dict[str, Dict]:
+        """The remote checkpoint index, from the local copy if it's fresh"""
+        target_file = self._remote_index_file(prefix)
+        if not refresh:
+            try:
+                if time.time() - os.stat(target_file).st_mtime < self.index_ttl:
+                    with open(target_file, 'r') as file:
+                        return json.load(file)
+            except (OSError, ValueError):
+                pass
+
+        index = self.remote.get_checkpoint_index(prefix)
+        ensure_dir(self.local._get_env_dir(prefix))
+        atomic_write(target_file, json.dumps(index), fsync=False)
+        return index
+
+    def _update_remote_index(self, prefix: str, entries: Dict[str, Dict], removed: Iterable[str] = ()):
+        # keep the local copy in sync with our own uploads, without
+        # making it look fresher than it is
+        target_file = self._remote_index_file(prefix)
+        try:
+            mtime = os.stat(target_file).st_mtime
+            with open(target_file, 'r') as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return
+        index.update(entries)
+        for uuid in removed:
+            index.pop(uuid, None)
+        atomic_write(target_file, json.dumps(index), fsync=False)
+        os.utime(target_file, (mtime, mtime))
+
+    def _enqueue(self, prefix: str, uuid: str):
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+                # retry uploads left behind by earlier processes
+                for item in self._find_pending():
+                    self._queue.put(item)
+        self._queue.put((prefix, uuid))
+
+    def _find_pending(self) -> List[tuple[str, str]]:
+        pending = []
+        for env_dir in os.scandir(self.local.data_dir):
+            if not env_dir.is_dir():
+                continue
+            for entry in os.scandir(env_dir.path):
+                if not entry.name.startswith(PENDING_MARKER_PREFIX):
+                    continue
+                uuid = entry.name[len(PENDING_MARKER_PREFIX):]
+                # the marker is written first, the save may never have happened
+                if not os.path.exists(os.path.join(env_dir.path, uuid)):
+                    continue
+                with contextlib.suppress(OSError), open(entry.path) as file:
+                    prefix = file.read()
+                    pending.append((prefix, uuid))
+        return pending
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            # wait a little for more saves so they can share one upload
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.batch_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._upload(batch)
+            if stop:
+                return
+
+    def _upload(self, batch: List[tuple[str, str]]):
+        by_prefix = {}
+        for prefix, uuid in batch:
+            by_prefix.setdefault(prefix, set()).add(uuid)
+
+        for prefix, uuids in by_prefix.items():
+            checkpoints = [self.local.get_environment_checkpoint(prefix, uuid) for uuid in uuids]
+            checkpoints = [c for c in checkpoints if c is not None]
+            try:
+                self.remote.save_environment_checkpoints(checkpoints, prefix)
+            except Exception as e:
+                # markers stay in place so the upload is retried later
+                warnings.warn(f"Failed to upload checkpoints for {prefix}: {e}")
+                continue
+            for checkpoint in checkpoints:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self._marker_file(prefix, checkpoint.uuid))
+            self._update_remote_index(prefix, {c.uuid: c.index_entry() for c in checkpoints})
+            self._evict(prefix)
+
+    def flush(self):
+        """Block until all queued uploads are done"""
+        with self._worker_lock:
+            worker = self._worker
+            self._worker = None
+        if worker is not None:
+            self._queue.put(None)
+            worker.join()
+
+    def delete_environment_checkpoint(self, prefix: str, uuid: str):
+        self.local.delete_environment_checkpoint(prefix, uuid)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._marker_file(prefix, uuid))
+        self.remote.delete_environment_checkpoint(prefix, uuid)
+        self._update_remote_index(prefix, {}, removed=[uuid])
+
+    def save_environment_checkpoint(self, checkpoint: environment.EnvironmentCheckpoint, prefix: str):
+        self.save_environment_checkpoints([checkpoint], prefix)
+
+    def save_environment_checkpoints(self, checkpoints: List[environment.EnvironmentCheckpoint], prefix: str):
+        # marker first, a crash before the save leaves a harmless marker
+        # rather than a checkpoint that is never uploaded
+        ensure_dir(self.local._get_env_dir(prefix))
+        for checkpoint in checkpoints:
+            atomic_write(self._marker_file(prefix, checkpoint.uuid), prefix, fsync=self.local.fsync)
+        self.local.save_environment_checkpoints(checkpoints, prefix)
+        # no eviction here, new checkpoints can't be evicted before they
+        # are uploaded and checking the remote would slow down saves
+        for checkpoint in checkpoints:
+            self._enqueue(prefix, checkpoint.uuid)
+
+    def list_checkpoint_uuids(self, prefix: str) -> List[str]:
+        uuids = set(self.local.list_checkpoint_uuids(prefix))
+        uuids.update(self._remote_index(prefix))
+        return list(uuids)
+
+    def get_checkpoint_index(self, prefix: str) -> Dict[str, Dict]:
+        index = self._remote_index(prefix)
+        # pending checkpoints are only in the local cache
+        index.update(self.local.get_checkpoint_index(prefix))
+        return index
+
+    def get_environment_checkpoints(self, prefix: str) -> List[environment.EnvironmentCheckpoint]:
+        checkpoints = self.local.get_environment_checkpoints(prefix)
+        local_uuids = {c.uuid for c in checkpoints}
+
+        # the rest is read straight from the remote, caching all of it
+        # would only push the recent checkpoints out of the cache
+        for uuid in self._remote_index(prefix, refresh=True):
+            if uuid in local_uuids:
+                continue
+            checkpoint = self.remote.get_environment_checkpoint(prefix, uuid)
+            if checkpoint is not None:
+                checkpoints.append(checkpoint)
+        return checkpoints
+
+    def get_environment_checkpoint(self, prefix: str, uuid: str) -> environment.EnvironmentCheckpoint | None:
+        checkpoint = self.local.get_environment_checkpoint(prefix, uuid)
+        if checkpoint is not None:
+            self._touch(prefix, uuid)
+            return checkpoint
+
+        checkpoint = self.remote.get_environment_checkpoint(prefix, uuid)
+        if checkpoint is not None:
+            # no eviction here, that only happens after uploads
+            self.local.save_environment_checkpoint(checkpoint, prefix)
+        return checkpoint
+
+
+def get_data_backend() -> DataBackend:
+    """The data backend configured by the environment
+
+    Set `DOF_REMOTE` to a path or file:// url (eg. an NFS mount) to
+    share checkpoints between machines, `DOF_CACHE_SIZE` controls how
+    many checkpoints per environment are kept locally.
+    """
+    remote_url = os.environ.get("DOF_REMOTE", None)
+    if remote_url is None:
+        return LocalData()
+    cache_size = int(os.environ.get("DOF_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+    return _cached_data(remote_url, cache_size)
+
+
+@functools.cache
+def _cached_data(remote_url: str, cache_size: int) -> CachedData:
+    # one instance per process so all saves share a single upload worker
+    return CachedData(
+        local=LocalData(),
+        remote=FilesystemRemoteData(remote_url),
+        max_entries=cache_size,
+    )
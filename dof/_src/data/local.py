@@ -1,11 +1,31 @@
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterable, List
+import contextlib
+import json
 import os
+import time
+import warnings
 import yaml
-import base64
 
+from pydantic import ValidationError
+
+from dof._src.data.backend import DataBackend
 from dof._src.models import environment
-from dof._src.utils import ensure_dir
+from dof._src.utils import TEMP_FILE_SUFFIX, atomic_write, ensure_dir, file_lock, fsync_file, write_temp_file
+
+# name of the advisory lock file kept in each env dir. Files starting
+# with a "." are never treated as checkpoints (this also covers the
+# temp files written by `write_temp_file`)
+LOCK_FILE_NAME = ".lock"
+# caches the fingerprint of the prefix keyed by a stat of its metadata
+STATUS_CACHE_FILE_NAME = ".status-cache"
+# uuid -> timestamp, tags and build_hash of each checkpoint in an env dir,
+# lets list/status skip parsing every checkpoint. It is rebuilt from the
+# checkpoint files when it's missing or out of date.
+INDEX_FILE_NAME = ".index"
+# temp files older than this were left behind by a crashed writer
+STALE_TEMP_FILE_SECONDS = 60 * 60
+
 
 def default_data_dir() -> Path:
     dof_dir = os.environ.get("DOF_DIR", None)
@@ -13,15 +33,18 @@ def default_data_dir() -> Path:
         dof_dir = Path.home() / ".dof"
     else:
         dof_dir = Path(dof_dir)
-    
+
     return dof_dir / "data"
 
-class LocalData:
-    def __init__(self, data_dir: str | None = None):
+class LocalData(DataBackend):
+    def __init__(self, data_dir: str | None = None, fsync: bool = True):
         self.data_dir = data_dir
         if self.data_dir is None:
             self.data_dir = str(default_data_dir())
-        
+        # fsync'ing makes saves durable across crashes/power loss at the
+        # cost of some latency, turn it off for throwaway data dirs
+        self.fsync = fsync
+
         ensure_dir(self.data_dir)
 
     def _get_env_dir(self, prefix: str):
@@ -31,41 +54,175 @@ class LocalData:
         name = prefix.replace("/", "-")
         return f"{self.data_dir}/{name}"
 
+    def _lock(self, target_dir: str):
+        """Advisory lock for an env dir
+
+        Writers only hold it while swapping their file in/out, the writing
+        and fsync'ing happens before. Readers don't lock at all, files are
+        only ever replaced atomically so they see a complete old or new one.
+        """
+        return file_lock(os.path.join(target_dir, LOCK_FILE_NAME))
+
+    def _read_index(self, target_dir: str) -> Dict[str, Dict]:
+        try:
+            with open(os.path.join(target_dir, INDEX_FILE_NAME), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _update_index(self, target_dir: str, entries: Dict[str, Dict], removed: Iterable[str] = ()):
+        """Merge entries into the index, the env dir lock must be held"""
+        index = self._read_index(target_dir)
+        index.update(entries)
+        for uuid in removed:
+            index.pop(uuid, None)
+        # the index can always be rebuilt, no need to fsync it
+        atomic_write(os.path.join(target_dir, INDEX_FILE_NAME), json.dumps(index), fsync=False)
+
+    def _publish(self, target_dir: str, checkpoints: List[environment.EnvironmentCheckpoint]):
+        """Atomically write checkpoints into `target_dir` and index them"""
+        # serialize, write and fsync outside of the lock, that's the slow part
+        tmp_paths = {
+            c.uuid: write_temp_file(
+                os.path.join(target_dir, c.uuid), yaml.dump(c.model_dump()), fsync=self.fsync
+            )
+            for c in checkpoints
+        }
+        try:
+            with self._lock(target_dir):
+                for uuid, tmp_path in tmp_paths.items():
+                    os.replace(tmp_path, os.path.join(target_dir, uuid))
+                self._update_index(target_dir, {c.uuid: c.index_entry() for c in checkpoints})
+        except BaseException:
+            for tmp_path in tmp_paths.values():
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(tmp_path)
+            raise
+        # a single dir fsync covers all the renames
+        if self.fsync:
+            fsync_file(target_dir)
+
+    def _read_checkpoint(self, target_file: str) -> environment.EnvironmentCheckpoint | None:
+        """Load a checkpoint file, returns None if the file is unreadable"""
+        try:
+            with open(target_file, 'r') as file:
+                contents = yaml.safe_load(file)
+            return environment.EnvironmentCheckpoint.model_validate(contents)
+        except FileNotFoundError:
+            # deleted by another process after we listed the dir
+            return None
+        except (OSError, yaml.YAMLError, ValidationError) as e:
+            warnings.warn(f"Skipping corrupt checkpoint file {target_file}: {e}")
+            return None
+
     def delete_environment_checkpoint(self, prefix: str, uuid: str):
         target_dir = self._get_env_dir(prefix)
         target_file = f"{target_dir}/{uuid}"
-        if os.path.exists(target_file):
-            os.remove(target_file)
+        if not os.path.exists(target_dir):
+            return
+        with self._lock(target_dir):
+            if os.path.exists(target_file):
+                os.remove(target_file)
+            self._update_index(target_dir, {}, removed=[uuid])
 
     def save_environment_checkpoint(self, checkpoint: environment.EnvironmentCheckpoint, prefix: str):
         target_dir = self._get_env_dir(prefix)
         ensure_dir(target_dir)
-        
-        target_file = f"{target_dir}/{checkpoint.uuid}"
-        with open(target_file, "w+") as file:
-            yaml.dump(checkpoint.model_dump(), file)
-    
-    def get_environment_checkpoints(self, prefix: str) -> List[environment.EnvironmentCheckpoint]:
+
+        self._publish(target_dir, [checkpoint])
+
+    def save_environment_checkpoints(self, checkpoints: List[environment.EnvironmentCheckpoint], prefix: str):
+        target_dir = self._get_env_dir(prefix)
+        ensure_dir(target_dir)
+
+        self._publish(target_dir, checkpoints)
+
+    def list_checkpoint_uuids(self, prefix: str) -> List[str]:
         target_dir = self._get_env_dir(prefix)
         if not os.path.exists(target_dir):
             return []
+        return [file for file in os.listdir(target_dir) if not file.startswith(".")]
+
+    def get_checkpoint_index(self, prefix: str) -> Dict[str, Dict]:
+        """See `DataBackend.get_checkpoint_index`
+
+        The index is brought up to date with the dir on the way. Corrupt
+        checkpoints are recorded with a `None` entry so they are only
+        parsed (and warned about) once, and temp files left behind by
+        crashed writers are removed.
+        """
+        target_dir = self._get_env_dir(prefix)
+        if not os.path.exists(target_dir):
+            return {}
         files = os.listdir(target_dir)
+        uuids = [file for file in files if not file.startswith(".")]
+        index = self._read_index(target_dir)
 
-        checkpoints = []
+        # checkpoints written by an older dof, or by hand, aren't indexed yet
+        missing = {}
+        for uuid in set(uuids) - set(index):
+            target_file = os.path.join(target_dir, uuid)
+            checkpoint = self._read_checkpoint(target_file)
+            if checkpoint is not None:
+                missing[uuid] = checkpoint.index_entry()
+            elif os.path.exists(target_file):
+                missing[uuid] = None
+        stale = set(index) - set(uuids)
+
+        now = time.time()
+        stale_temp_files = []
         for file in files:
-            with open(os.path.join(target_dir, file), 'r') as file:
-                contents = yaml.safe_load(file)
-            
-            checkpoints.append(environment.EnvironmentCheckpoint.parse_obj(contents))
-        
+            if not (file.startswith(".") and file.endswith(TEMP_FILE_SUFFIX)):
+                continue
+            with contextlib.suppress(OSError):
+                if now - os.stat(os.path.join(target_dir, file)).st_mtime > STALE_TEMP_FILE_SECONDS:
+                    stale_temp_files.append(file)
+
+        if missing or stale or stale_temp_files:
+            with self._lock(target_dir):
+                # only drop what is really gone, files may have been
+                # added since we listed the dir
+                removed = [uuid for uuid in stale if not os.path.exists(os.path.join(target_dir, uuid))]
+                self._update_index(target_dir, missing, removed=removed)
+                for file in stale_temp_files:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(os.path.join(target_dir, file))
+
+        index.update(missing)
+        return {uuid: index[uuid] for uuid in uuids if index.get(uuid) is not None}
+
+    def get_environment_checkpoints(self, prefix: str) -> List[environment.EnvironmentCheckpoint]:
+        target_dir = self._get_env_dir(prefix)
+        if not os.path.exists(target_dir):
+            return []
+
+        checkpoints = []
+        for file in self.list_checkpoint_uuids(prefix):
+            checkpoint = self._read_checkpoint(os.path.join(target_dir, file))
+            if checkpoint is not None:
+                checkpoints.append(checkpoint)
+
         return checkpoints
-    
+
     def get_environment_checkpoint(self, prefix: str, uuid: str) -> environment.EnvironmentCheckpoint:
         target_dir = self._get_env_dir(prefix)
         target_file = f"{target_dir}/{uuid}"
         if not os.path.exists(target_file):
             return None
-        
-        with open(target_file, 'r') as file:
-            contents = yaml.safe_load(file)
-            return environment.EnvironmentCheckpoint.parse_obj(contents)
+
+        return self._read_checkpoint(target_file)
+
+    def get_status_cache(self, prefix: str) -> dict | None:
+        target_file = os.path.join(self._get_env_dir(prefix), STATUS_CACHE_FILE_NAME)
+        try:
+            with open(target_file, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def save_status_cache(self, prefix: str, stat_key: str, build_hash: str):
+        target_dir = self._get_env_dir(prefix)
+        ensure_dir(target_dir)
+        contents = json.dumps({"stat_key": stat_key, "build_hash": build_hash})
+        # only a cache, no need to pay for fsync or the lock
+        atomic_write(os.path.join(target_dir, STATUS_CACHE_FILE_NAME), contents, fsync=False)
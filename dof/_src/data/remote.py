@@ -0,0 +1,24 @@
+from urllib.parse import urlparse
+
+from dof._src.data.local import LocalData
+from dof._src.exceptions import UnsupportedDataRemote
+
+
+class FilesystemRemoteData(LocalData):
+    """Checkpoints stored on a shared filesystem, eg. an NFS mount
+
+    Uses the same layout, atomic writes and locking as `LocalData` so
+    many nodes can read and write the same remote at once.
+    """
+
+    def __init__(self, url: str, fsync: bool = True):
+        super().__init__(data_dir=_parse_remote_url(url), fsync=fsync)
+
+
+def _parse_remote_url(url: str) -> str:
+    parsed = urlparse(url)
+    if parsed.scheme == "":
+        return url
+    if parsed.scheme == "file":
+        return parsed.path
+    raise UnsupportedDataRemote(url)
@@ -7,3 +7,36 @@ class DockerBuildFailed(Exception):
             f"\nError message: {err}"
         )
         super().__init__(self.msg)
+
+
+class UnsupportedDataRemote(Exception):
+    def __init__(self, url):
+        self.msg = (
+            f"Unsupported data remote `{url}`!"
+            f"\nOnly filesystem paths and file:// urls are supported"
+        )
+        super().__init__(self.msg)
+
+
+class DaemonError(Exception):
+    def __init__(self, err):
+        self.msg = f"dof daemon error: {err}"
+        super().__init__(self.msg)
+
+
+class PostLinkScriptFailed(Exception):
+    def __init__(self, name, returncode, err):
+        self.msg = (
+            f"post-link script for `{name}` failed with exit code {returncode}!"
+            f"\nError message: {err}"
+        )
+        super().__init__(self.msg)
+
+
+class MirrorConflict(Exception):
+    def __init__(self, file_name, urls):
+        self.msg = (
+            f"Can't mirror `{file_name}`, these packages have the same file name"
+            f" but different checksums:\n" + "\n".join(urls)
+        )
+        super().__init__(self.msg)
@@ -0,0 +1,63 @@
+import hashlib
+import os
+import shutil
+import urllib.request
+
+from dof._src.models import package
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def dist_name(url: str) -> str:
+    """Package file name without the extension, eg. 'jinja2-3.1.5-pyhd8ed1ab_0'"""
+    file_name = url.split("/")[-1]
+    for ext in (".conda", ".tar.bz2"):
+        if file_name.endswith(ext):
+            return file_name[:-len(ext)]
+    return file_name
+
+
+def download_file(url: str, path: str):
+    with urllib.request.urlopen(url) as response, open(path, "wb") as file:
+        shutil.copyfileobj(response, file, CHUNK_SIZE)
+
+
+def file_digest(path: str, algorithm: str) -> str:
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as file:
+        while chunk := file.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def verify_package(pkg: package.Package, path: str):
+    """Check a downloaded package against the checksum recorded for it"""
+    if pkg.sha256 is not None:
+        algorithm, expected = "sha256", pkg.sha256
+    elif pkg.md5 is not None:
+        algorithm, expected = "md5", pkg.md5
+    else:
+        if pkg.size is not None and os.path.getsize(path) != pkg.size:
+            raise ValueError(f"size mismatch for {pkg.url}")
+        return
+
+    actual = file_digest(path, algorithm)
+    if actual != expected:
+        raise ValueError(
+            f"{algorithm} mismatch for {pkg.url}: expected {expected}, got {actual}"
+        )
+
+
+def record_matches(pkg: package.Package, record: dict) -> bool:
+    """Whether a package record (eg. repodata_record.json or conda-meta)
+    describes the same artifact as `pkg`
+
+    Decided by checksum. Records without one only match packages that
+    have no checksum recorded either.
+    """
+    for algorithm in ("sha256", "md5"):
+        expected = getattr(pkg, algorithm)
+        if expected is not None and record.get(algorithm) is not None:
+            return record[algorithm] == expected
+    return pkg.sha256 is None and pkg.md5 is None
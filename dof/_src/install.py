@@ -0,0 +1,335 @@
+from typing import Callable, Dict, List
+import json
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+import warnings
+
+from conda.base.context import context
+from conda.core.package_cache_data import PackageCacheData
+from rich.console import Console
+from rich.progress import BarColumn, MofNCompleteColumn, Progress, TextColumn, TimeElapsedColumn
+
+from dof._src.clone import (
+    PackageLinker,
+    cache_source,
+    download_package,
+    extract_package,
+    find_python_version,
+)
+from dof._src.exceptions import PostLinkScriptFailed
+from dof._src.fetch import dist_name, verify_package
+from dof._src.models import package
+from dof._src.utils import ensure_dir
+
+
+STAGES = ("download", "verify", "extract", "link")
+DEFAULT_STAGE_WORKERS = {"download": 8, "verify": 2, "extract": 4, "link": 4}
+# max items waiting between two stages, keeps downloads from running
+# far ahead of extraction and filling up the disk
+DEFAULT_QUEUE_SIZE = 16
+
+_DONE = object()
+
+
+class _Channel:
+    """Bounded queue between stages that closes once all producers are done"""
+
+    def __init__(self, maxsize: int, producers: int, consumers: int):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self._producers = producers
+        self._consumers = consumers
+        self._lock = threading.Lock()
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def get(self):
+        return self.queue.get()
+
+    def producer_done(self):
+        with self._lock:
+            self._producers -= 1
+            closed = self._producers == 0
+        if closed:
+            for _ in range(self._consumers):
+                self.queue.put(_DONE)
+
+
+class _StageStats:
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, start: float, end: float, nbytes: int):
+        with self._lock:
+            self.count += 1
+            self.bytes += nbytes
+            self.busy_seconds += end - start
+            self.started = start if self.started is None else min(self.started, start)
+            self.finished = end if self.finished is None else max(self.finished, end)
+
+    @property
+    def wall_seconds(self) -> float:
+        if self.started is None:
+            return 0.0
+        return self.finished - self.started
+
+    @property
+    def mb_per_second(self) -> float:
+        if self.wall_seconds == 0:
+            return 0.0
+        return self.bytes / self.wall_seconds / 1e6
+
+    def to_dict(self) -> Dict:
+        return {
+            "packages": self.count,
+            "bytes": self.bytes,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "wall_seconds": round(self.wall_seconds, 3),
+            "mb_per_second": round(self.mb_per_second, 3),
+        }
+
+
+class InstallPipeline:
+    """Install packages into a prefix with download, verify, extract and
+    link running as concurrent stages
+
+    Packages already in a package cache skip straight to linking. The
+    rest are downloaded largest first so the slowest transfers start
+    early, and bounded queues between stages apply backpressure. Progress
+    and per stage throughput are shown with rich.
+    """
+
+    def __init__(
+        self,
+        target_prefix: str,
+        packages: List[package.Package],
+        workers: Dict[str, int] | None = None,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        console: Console | None = None,
+    ):
+        self.target_prefix = target_prefix
+        self.packages = [pkg for pkg in packages if not isinstance(pkg, package.PipPackage)]
+        if len(self.packages) != len(packages):
+            warnings.warn("pip packages are not installed")
+        self.workers = {**DEFAULT_STAGE_WORKERS, **(workers or {})}
+        self.queue_size = queue_size
+        self.console = console or Console(stderr=True)
+
+        self.stats = {stage: _StageStats() for stage in STAGES}
+        self.package_timings: Dict[str, Dict[str, float]] = {}
+        self._timings_lock = threading.Lock()
+        self._errors: List[BaseException] = []
+        self._cancelled = threading.Event()
+
+    def _size(self, pkg: package.Package, path: str | None = None) -> int:
+        if path is not None and os.path.isfile(path):
+            return os.path.getsize(path)
+        return pkg.size or 0
+
+    def _discard(self, item: tuple):
+        # downloaded tarballs live in their own work dir until extracted
+        if len(item) > 1 and isinstance(item[1], str):
+            shutil.rmtree(os.path.dirname(item[1]), ignore_errors=True)
+
+    def _run_stage(
+        self,
+        stage: str,
+        func: Callable,
+        inbox: _Channel,
+        outbox: _Channel | None,
+        progress: Progress,
+        task_id,
+    ):
+        stats = self.stats[stage]
+        try:
+            while True:
+                item = inbox.get()
+                if item is _DONE:
+                    return
+                if self._cancelled.is_set():
+                    # keep draining so upstream stages don't block forever
+                    self._discard(item)
+                    continue
+                pkg = item[0]
+                start = time.monotonic()
+                try:
+                    result, nbytes = func(*item)
+                except BaseException as e:
+                    self._errors.append(e)
+                    self._cancelled.set()
+                    self._discard(item)
+                    continue
+                end = time.monotonic()
+                stats.record(start, end, nbytes)
+                with self._timings_lock:
+                    self.package_timings.setdefault(pkg.url, {})[stage] = round(end - start, 3)
+                progress.update(
+                    task_id,
+                    advance=1,
+                    description=f"{stage:<8} {stats.mb_per_second:8.1f} MB/s",
+                )
+                if outbox is not None:
+                    outbox.put((pkg, result))
+        finally:
+            if outbox is not None:
+                outbox.producer_done()
+
+    def run(self) -> Dict:
+        start = time.monotonic()
+        ensure_dir(self.target_prefix)
+        pkgs_dirs = list(context.pkgs_dirs)
+        pkgs_dir = PackageCacheData.first_writable().pkgs_dir
+
+        cached = []
+        to_fetch = []
+        for pkg in self.packages:
+            source = cache_source(pkg, pkgs_dirs)
+            if source is not None:
+                cached.append((pkg, source))
+            else:
+                to_fetch.append(pkg)
+        # start the biggest downloads first, they dominate the total time
+        to_fetch.sort(key=lambda pkg: pkg.size or 0, reverse=True)
+
+        linker = PackageLinker(self.target_prefix, find_python_version(self.packages))
+
+        def download(pkg):
+            tarball = download_package(pkg, pkgs_dir)
+            return tarball, self._size(pkg, tarball)
+
+        def verify(pkg, tarball):
+            try:
+                verify_package(pkg, tarball)
+            except ValueError:
+                shutil.rmtree(os.path.dirname(tarball), ignore_errors=True)
+                raise
+            return tarball, self._size(pkg, tarball)
+
+        def extract(pkg, tarball):
+            nbytes = self._size(pkg, tarball)
+            return extract_package(pkg, tarball, pkgs_dir), nbytes
+
+        def link(pkg, source):
+            linker.link(source)
+            return None, self._size(pkg)
+
+        workers = self.workers
+        to_download = _Channel(0, 1, workers["download"])
+        to_verify = _Channel(self.queue_size, workers["download"], workers["verify"])
+        to_extract = _Channel(self.queue_size, workers["verify"], workers["extract"])
+        # the extract workers and the feeder of cached packages
+        to_link = _Channel(self.queue_size, workers["extract"] + 1, workers["link"])
+
+        stages = [
+            ("download", download, to_download, to_verify, len(to_fetch)),
+            ("verify", verify, to_verify, to_extract, len(to_fetch)),
+            ("extract", extract, to_extract, to_link, len(to_fetch)),
+            ("link", link, to_link, None, len(self.packages)),
+        ]
+
+        progress = Progress(
+            TextColumn("{task.description}"),
+            BarColumn(),
+            MofNCompleteColumn(),
+            TimeElapsedColumn(),
+            console=self.console,
+        )
+        threads = []
+        with progress:
+            for stage, func, inbox, outbox, total in stages:
+                task_id = progress.add_task(f"{stage:<8} {0:8.1f} MB/s", total=total)
+                for _ in range(workers[stage]):
+                    thread = threading.Thread(
+                        target=self._run_stage,
+                        args=(stage, func, inbox, outbox, progress, task_id),
+                        daemon=True,
+                    )
+                    thread.start()
+                    threads.append(thread)
+
+            def feed():
+                for pkg in to_fetch:
+                    to_download.put((pkg,))
+                to_download.producer_done()
+                for item in cached:
+                    to_link.put(item)
+                to_link.producer_done()
+
+            feeder = threading.Thread(target=feed, daemon=True)
+            feeder.start()
+            feeder.join()
+            for thread in threads:
+                thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        post_link_start = time.monotonic()
+        _run_post_link_scripts(self.target_prefix, self.packages)
+        history_file = os.path.join(self.target_prefix, "conda-meta", "history")
+        if not os.path.isfile(history_file):
+            with open(history_file, "w") as f:
+                f.write("# history file created with dof")
+
+        summary = {
+            "prefix": self.target_prefix,
+            "packages": len(self.packages),
+            "cached": len(cached),
+            "fetched": len(to_fetch),
+            "wall_seconds": round(time.monotonic() - start, 3),
+            "stages": {stage: stats.to_dict() for stage, stats in self.stats.items()},
+            "post_link_seconds": round(time.monotonic() - post_link_start, 3),
+            "package_timings": self.package_timings,
+        }
+        self._print_summary(summary)
+        return summary
+
+    def _print_summary(self, summary: Dict):
+        self.console.print(
+            f"installed {summary['packages']} packages into {summary['prefix']} "
+            f"in {summary['wall_seconds']:.1f}s ({summary['cached']} cached, "
+            f"{summary['fetched']} fetched)"
+        )
+        for stage, stats in summary["stages"].items():
+            self.console.print(
+                f"  {stage:<8} {stats['packages']:>4} packages "
+                f"{stats['wall_seconds']:8.2f}s {stats['mb_per_second']:8.1f} MB/s"
+            )
+
+
+def _run_post_link_scripts(target_prefix: str, packages: List[package.Package]):
+    """Run the post-link scripts of the packages, in install order
+
+    Like conda, the prefix's bin dir comes first on PATH and a failing
+    script fails the install.
+    """
+    for pkg in packages:
+        name, version, build = dist_name(pkg.url).rsplit("-", 2)
+        script = os.path.join(target_prefix, "bin", f".{name}-post-link.sh")
+        if not os.path.isfile(script):
+            continue
+        env = {
+            **os.environ,
+            "PREFIX": target_prefix,
+            "PKG_NAME": name,
+            "PKG_VERSION": version,
+            "PKG_BUILDNUM": build.rsplit("_", 1)[-1],
+            "PATH": os.pathsep.join([os.path.join(target_prefix, "bin"), os.environ.get("PATH", "")]),
+        }
+        result = subprocess.run(["/bin/bash", script], env=env, capture_output=True)
+        if result.returncode != 0:
+            raise PostLinkScriptFailed(name, result.returncode, result.stderr.decode())
+
+
+def write_summary(summary: Dict, path: str):
+    with open(path, "w") as file:
+        json.dump(summary, file, indent=2)
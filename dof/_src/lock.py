@@ -6,13 +6,15 @@ from typing import List
 from rattler import solve, Platform
 
 from dof._src.models.environment import CondaEnvironmentSpec, EnvironmentSpec, EnvironmentMetadata
-from dof._src.models.package import UrlCondaPackage
-from dof._src.utils import hash_string
+from dof._src.models.package import UrlCondaPackage, fingerprint
 
 
 # TODO: don't use this
-def lock_environment(path: str, target_platform: str | None = None) -> EnvironmentSpec:
+def lock_environment(path: str, target_platform: str | None = None, channel_override: str | None = None) -> EnvironmentSpec:
     lock_spec =  _parse_environment_file(path)
+    if channel_override is not None:
+        # eg. a mirror built with `dof mirror build`
+        lock_spec.channels = [channel_override]
 
     if target_platform is None:
         target_platform = Platform.current()
@@ -23,12 +25,20 @@ def lock_environment(path: str, target_platform: str | None = None) -> Environme
 
     url_packages = []
     for pkg in solution_packages:
-        url_packages.append(UrlCondaPackage(url = pkg.url))
+        url_packages.append(UrlCondaPackage(
+            url = pkg.url,
+            md5 = pkg.md5.hex() if pkg.md5 else None,
+            sha256 = pkg.sha256.hex() if pkg.sha256 else None,
+            size = pkg.size,
+            depends = list(pkg.depends),
+            constrains = list(pkg.constrains),
+            noarch = _noarch_value(pkg.noarch),
+        ))
 
     env_metadata = EnvironmentMetadata(
         platform = str(target_platform),
         channels = lock_spec.channels,
-        build_hash = hash_string(str(url_packages)),
+        build_hash = fingerprint(url_packages),
     )
 
     env_spec = EnvironmentSpec(
@@ -39,6 +49,16 @@ def lock_environment(path: str, target_platform: str | None = None) -> Environme
     return env_spec
 
 
+def _noarch_value(noarch) -> str | None:
+    if noarch is None:
+        return None
+    if noarch.python:
+        return "python"
+    if noarch.generic:
+        return "generic"
+    return None
+
+
 def _parse_environment_file(path: str) -> CondaEnvironmentSpec:
     with open(path, 'r') as file:
         raw_env_spec = yaml.safe_load(file)
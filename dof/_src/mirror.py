@@ -0,0 +1,210 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List
+import contextlib
+import json
+import os
+import tarfile
+import tempfile
+import warnings
+import zipfile
+
+from dof._src.exceptions import MirrorConflict
+from dof._src.fetch import dist_name, download_file, file_digest, verify_package
+from dof._src.models import package
+from dof._src.utils import atomic_write, ensure_dir
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+DEFAULT_MIRROR_WORKERS = 8
+
+
+def mirror_channel_url(mirror: str) -> str:
+    """file:// url of a mirror dir, accepts a path or a file:// url"""
+    if mirror.startswith("file://"):
+        return mirror.rstrip("/")
+    return Path(mirror).resolve().as_uri()
+
+
+def override_channel(packages: List[package.Package], channel_url: str) -> List[package.Package]:
+    """Point conda packages at the same file in another channel, eg. a mirror"""
+    overridden = []
+    for pkg in packages:
+        if isinstance(pkg, package.PipPackage):
+            overridden.append(pkg)
+            continue
+        _, subdir, file_name = pkg.url.rsplit("/", 2)
+        update = {"url": f"{channel_url}/{subdir}/{file_name}"}
+        if isinstance(pkg, package.CondaPackage):
+            update["conda_channel"] = f"{channel_url}/{subdir}"
+        overridden.append(pkg.model_copy(update=update))
+    return overridden
+
+
+def restore_channel(prefix: str, packages: List[package.Package]):
+    """Record the original urls of packages installed from another channel
+
+    Rewrites the conda-meta records in `prefix` so the environment
+    matches the checkpoint it was installed from instead of pointing
+    at a machine local mirror.
+    """
+    for pkg in packages:
+        if isinstance(pkg, package.PipPackage):
+            continue
+        meta_file = os.path.join(prefix, "conda-meta", f"{dist_name(pkg.url)}.json")
+        try:
+            with open(meta_file) as file:
+                record = json.load(file)
+        except FileNotFoundError:
+            continue
+        record["url"] = pkg.url
+        if isinstance(pkg, package.CondaPackage):
+            record["channel"] = pkg.conda_channel
+        else:
+            record["channel"] = pkg.url.rsplit("/", 1)[0]
+        atomic_write(meta_file, json.dumps(record, indent=2), fsync=False)
+
+
+def _read_index_json(path: str) -> Dict | None:
+    """info/index.json from a .tar.bz2 or .conda package file"""
+    if path.endswith(".tar.bz2"):
+        with tarfile.open(path, "r:bz2") as tar:
+            return json.load(tar.extractfile("info/index.json"))
+
+    if zstandard is None:
+        return None
+    with zipfile.ZipFile(path) as archive:
+        info_name = f"info-{dist_name(path)}.tar.zst"
+        with archive.open(info_name) as compressed:
+            reader = zstandard.ZstdDecompressor().stream_reader(compressed)
+            with tarfile.open(fileobj=reader, mode="r|") as tar:
+                for member in tar:
+                    if member.name == "info/index.json":
+                        return json.load(tar.extractfile(member))
+    return None
+
+
+def _same_artifact(a: package.Package, b: package.Package) -> bool:
+    for algorithm in ("sha256", "md5"):
+        a_digest, b_digest = getattr(a, algorithm), getattr(b, algorithm)
+        if a_digest is not None and b_digest is not None:
+            return a_digest == b_digest
+    # nothing to compare, the download is verified against the first one
+    return True
+
+
+def _model_record(pkg: package.Package, subdir: str) -> Dict:
+    """Repodata entry from what the checkpoint recorded about a package"""
+    name, version, build = dist_name(pkg.url).rsplit("-", 2)
+    build_number = build.rsplit("_", 1)[-1]
+    record = {
+        "name": name,
+        "version": version,
+        "build": build,
+        "build_number": int(build_number) if build_number.isdigit() else 0,
+        "subdir": subdir,
+        "depends": pkg.depends,
+        "constrains": pkg.constrains,
+    }
+    if pkg.noarch is not None:
+        record["noarch"] = pkg.noarch
+    return record
+
+
+def _mirror_package(pkg: package.Package, out_dir: str) -> tuple[str, str, Dict, bool]:
+    _, subdir, file_name = pkg.url.rsplit("/", 2)
+    subdir_path = os.path.join(out_dir, subdir)
+    target = os.path.join(subdir_path, file_name)
+
+    downloaded = False
+    if os.path.isfile(target):
+        try:
+            verify_package(pkg, target)
+        except ValueError:
+            os.remove(target)
+
+    if not os.path.isfile(target):
+        fd, tmp_path = tempfile.mkstemp(dir=subdir_path, prefix=f".{file_name}.")
+        os.close(fd)
+        try:
+            download_file(pkg.url, tmp_path)
+            verify_package(pkg, tmp_path)
+            os.replace(tmp_path, target)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+        downloaded = True
+
+    record = _read_index_json(target)
+    if record is None:
+        warnings.warn(f"can't read index.json from {file_name}, using the recorded metadata")
+        record = _model_record(pkg, subdir)
+    record.update(
+        md5=file_digest(target, "md5"),
+        sha256=file_digest(target, "sha256"),
+        size=os.path.getsize(target),
+    )
+    return subdir, file_name, record, downloaded
+
+
+def _write_repodata(subdir_path: str, subdir: str, records: Dict[str, Dict]):
+    repodata_file = os.path.join(subdir_path, "repodata.json")
+    repodata = {"info": {"subdir": subdir}, "packages": {}, "packages.conda": {}, "removed": [], "repodata_version": 1}
+    # add to what an earlier build left behind
+    if os.path.isfile(repodata_file):
+        with open(repodata_file) as file:
+            repodata.update(json.load(file))
+    for file_name, record in records.items():
+        key = "packages.conda" if file_name.endswith(".conda") else "packages"
+        repodata[key][file_name] = record
+    atomic_write(repodata_file, json.dumps(repodata, indent=2, sort_keys=True))
+
+
+def build_mirror(
+    packages: Iterable[package.Package],
+    out_dir: str,
+    max_workers: int = DEFAULT_MIRROR_WORKERS,
+) -> Dict:
+    """Build a local conda channel that holds the given packages
+
+    Every package is downloaded once (files already in the mirror with
+    the right checksum are reused) and each subdir gets a minimal
+    repodata.json, so the dir can be used as a file:// channel.
+    """
+    # keyed on where the file lands in the mirror, the same file name
+    # can come from more than one channel
+    unique = {}
+    for pkg in packages:
+        if isinstance(pkg, package.PipPackage):
+            continue
+        _, subdir, file_name = pkg.url.rsplit("/", 2)
+        seen = unique.setdefault((subdir, file_name), pkg)
+        if not _same_artifact(seen, pkg):
+            raise MirrorConflict(f"{subdir}/{file_name}", [seen.url, pkg.url])
+
+    # conda expects a noarch subdir in every channel
+    subdirs = {"noarch"} | {subdir for subdir, _ in unique}
+    for subdir in subdirs:
+        ensure_dir(os.path.join(out_dir, subdir))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(lambda pkg: _mirror_package(pkg, out_dir), unique.values()))
+
+    records = {subdir: {} for subdir in subdirs}
+    downloaded = 0
+    for subdir, file_name, record, was_downloaded in results:
+        records[subdir][file_name] = record
+        downloaded += was_downloaded
+    for subdir, subdir_records in records.items():
+        _write_repodata(os.path.join(out_dir, subdir), subdir, subdir_records)
+
+    return {
+        "packages": len(unique),
+        "downloaded": downloaded,
+        "reused": len(unique) - downloaded,
+        "subdirs": sorted(subdirs),
+    }
@@ -5,6 +5,11 @@ from pydantic import BaseModel, Field
 from dof._src.models import package
 
 
+# specs before this version were saved with a build_hash that isn't the
+# canonical `package.fingerprint` of their packages
+CANONICAL_HASH_SPEC_VERSION = "0.0.2"
+
+
 class CondaEnvironmentSpec(BaseModel):
     """Input conda environment.yaml spec"""
     name: Optional[str]
@@ -15,7 +20,7 @@ class CondaEnvironmentSpec(BaseModel):
 
 class EnvironmentMetadata(BaseModel):
     """Metadata for an environment"""
-    spec_version: str = "0.0.1"
+    spec_version: str = CANONICAL_HASH_SPEC_VERSION
     platform: str
     build_hash: str
     channels: List[str]
@@ -32,6 +37,12 @@ class EnvironmentSpec(BaseModel):
     packages: List[package.Package]
     env_vars: Optional[Dict[str, str]] = None
 
+    def fingerprint(self) -> str:
+        """Canonical fingerprint of the packages, see `package.fingerprint`"""
+        if self.metadata.spec_version == "0.0.1":
+            return package.fingerprint(self.packages)
+        return self.metadata.build_hash
+
 
 class EnvironmentCheckpoint(BaseModel):
     """An environment at a point in time
@@ -42,3 +53,11 @@ class EnvironmentCheckpoint(BaseModel):
     timestamp: str
     uuid: str
     tags: List[str]
+
+    def index_entry(self) -> Dict[str, Any]:
+        """What listing and status need to know about a checkpoint"""
+        return {
+            "timestamp": self.timestamp,
+            "tags": self.tags,
+            "build_hash": self.environment.fingerprint(),
+        }
@@ -1,9 +1,44 @@
-from typing import Union, Optional
+from typing import Iterable, List, Union, Optional
 from rattler import RepoDataRecord, PackageRecord
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
+from dof._src.utils import hash_string
 
-class CondaPackage(BaseModel):
+
+# values of conda's `Platform` enum. Checkpoints saved by older versions
+# of dof recorded "linux-64" as the platform of every package, that must
+# not end up in conda-meta where conda can't load it
+CONDA_PLATFORMS = {"emscripten", "freebsd", "linux", "osx", "wasi", "win", "zos"}
+
+
+class ArtifactMetadata(BaseModel):
+    """Checksums and dependency info of a conda package artifact
+
+    All optional so that checkpoints and lockfiles written before these
+    were recorded still load.
+    """
+    # hex digests of the package file
+    md5: Optional[str] = None
+    sha256: Optional[str] = None
+    size: Optional[int] = None
+    depends: List[str] = Field(default=[])
+    constrains: List[str] = Field(default=[])
+    # "python" or "generic" for noarch packages
+    noarch: Optional[str] = None
+
+    def _record_metadata(self) -> dict:
+        """Keyword arguments for a rattler PackageRecord"""
+        return dict(
+            md5=bytes.fromhex(self.md5) if self.md5 else None,
+            sha256=bytes.fromhex(self.sha256) if self.sha256 else None,
+            size=self.size,
+            depends=self.depends,
+            constrains=self.constrains,
+            noarch=self.noarch,
+        )
+
+
+class CondaPackage(ArtifactMetadata):
     name: str
     version: str
     build: str
@@ -23,12 +58,21 @@ class CondaPackage(BaseModel):
             return self.url == other.url
         return False
 
+    def identity(self) -> str:
+        """Stable string that uniquely identifies this package"""
+        # same identity as a UrlCondaPackage for the same artifact
+        return self.url
+
     def to_repodata_record(self):
         """Converts a conda package into a rattler compatible repodata record."""
+        # arch is only meaningful together with a valid platform
+        valid_platform = self.platform in CONDA_PLATFORMS
         pkg_record = PackageRecord(
              name=self.name, version=self.version, build=self.build,
-             build_number=self.build_number, subdir=self.subdir, arch=None,
-             platform=None
+             build_number=self.build_number, subdir=self.subdir,
+             arch=(self.arch or None) if valid_platform else None,
+             platform=self.platform if valid_platform else None,
+             **self._record_metadata(),
         )
         return RepoDataRecord(
             package_record=pkg_record,
@@ -51,6 +95,10 @@ class PipPackage(BaseModel):
         if isinstance(other, PipPackage):
             return self.name == other.name and self.version == other.version and self.build == other.build
         return False
+
+    def identity(self) -> str:
+        """Stable string that uniquely identifies this package"""
+        return f"pypi:{self.name}=={self.version}={self.build}"
     
     def to_repodata_record(self):
         """Converts a pip package into a rattler compatible repodata record."""
@@ -58,7 +106,7 @@ class PipPackage(BaseModel):
         pass
 
 
-class UrlCondaPackage(BaseModel):
+class UrlCondaPackage(ArtifactMetadata):
     url: str
 
     def __str__(self):
@@ -67,5 +115,43 @@ class UrlCondaPackage(BaseModel):
         name = "-".join(package.split("-")[:-2])
         return f"conda: {name} - {version}"
 
+    def to_repodata_record(self):
+        """Converts a conda package into a rattler compatible repodata record.
+
+        Name, version and build come from the file name, the channel and
+        subdir from the rest of the url, eg.
+        'https://conda.anaconda.org/conda-forge/noarch/jinja2-3.1.5-pyhd8ed1ab_0.conda'
+        """
+        channel, subdir, file_name = self.url.rsplit("/", 2)
+        dist = file_name.removesuffix(".conda").removesuffix(".tar.bz2")
+        name, version, build = dist.rsplit("-", 2)
+        build_number = build.rsplit("_", 1)[-1]
+        pkg_record = PackageRecord(
+             name=name, version=version, build=build,
+             build_number=int(build_number) if build_number.isdigit() else 0,
+             subdir=subdir, **self._record_metadata(),
+        )
+        return RepoDataRecord(
+            package_record=pkg_record,
+            file_name=file_name,
+            channel=channel,
+            url=self.url
+        )
+
+    def identity(self) -> str:
+        """Stable string that uniquely identifies this package"""
+        return self.url
+
 
 Package = Union[CondaPackage, PipPackage, UrlCondaPackage]
+
+
+def fingerprint(packages: Iterable[Package]) -> str:
+    """Canonical hash for a set of packages
+
+    Only depends on the identity of each package, not on the order of
+    the packages or how the models are rendered, so two environments with
+    the same packages always get the same fingerprint.
+    """
+    identities = sorted(pkg.identity() for pkg in packages)
+    return hash_string("\n".join(identities))
@@ -7,10 +7,12 @@ class Park:
 
     def __init__(self, url: str):
         self.url = url
+        # reuse connections across calls, matters for long running processes
+        self.session = requests.Session()
 
     def push(self, namespace: str, environment: str, checkpoint: str, data: dict):
         request_url = f"{self.url}/{namespace}/{environment}/{checkpoint}/json"
-        response = requests.post(
+        response = self.session.post(
             request_url,
             data=json.dumps(data),
             headers={"Content-Type": "application/json"}
@@ -20,7 +22,7 @@ class Park:
 
     def pull(self, namespace: str, environment: str, checkpoint: str):
         request_url = f"{self.url}/{namespace}/{environment}/{checkpoint}"
-        response = requests.get(request_url)
+        response = self.session.get(request_url)
         response.raise_for_status()
         data = response.json()
         return data["data"]["checkpoint_data"]
@@ -0,0 +1,150 @@
+from typing import Dict, List
+import datetime
+import threading
+
+from dof._src.checkpoint import Checkpoint, prefix_fingerprint
+from dof._src.data.backend import DataBackend
+from dof._src.data.cached import get_data_backend
+from dof._src.models import environment
+from dof._src.park.park import Park
+from dof._src.utils import prefix_stat_key, short_uuid
+
+
+class DofService:
+    """The operations behind the dof cli
+
+    Results are plain json-able data so the same calls can be served
+    in-process or by `dof serve`. list and status only read the checkpoint
+    index of the data dir. Parsed checkpoints, prefix scans and park
+    sessions are kept in memory, which pays off when one instance
+    handles many calls.
+    """
+
+    def __init__(self, data_dir: DataBackend | None = None):
+        self.data_dir = data_dir
+        if self.data_dir is None:
+            self.data_dir = get_data_backend()
+
+        # prefix -> {uuid: checkpoint} of the checkpoints loaded so far,
+        # checkpoints never change once saved and deletes go through `delete`
+        self._checkpoints: Dict[str, Dict[str, environment.EnvironmentCheckpoint]] = {}
+        # prefix -> (stat key, spec of the packages installed in the prefix)
+        self._prefix_specs: Dict[str, tuple[str, environment.EnvironmentSpec]] = {}
+        self._parks: Dict[str, Park] = {}
+        # checkpoint/prefix caches are shared between request threads
+        self._lock = threading.RLock()
+
+    def _get_checkpoint(self, prefix: str, uuid: str) -> environment.EnvironmentCheckpoint:
+        with self._lock:
+            checkpoint = self._checkpoints.get(prefix, {}).get(uuid)
+        if checkpoint is None:
+            checkpoint = self.data_dir.get_environment_checkpoint(prefix, uuid)
+        if checkpoint is None:
+            raise ValueError(f"revision {uuid} not found")
+        with self._lock:
+            self._checkpoints.setdefault(prefix, {})[uuid] = checkpoint
+        return checkpoint
+
+    def _get_prefix_spec(self, prefix: str) -> environment.EnvironmentSpec:
+        """Spec of what is installed in prefix, only rescanned when it changes"""
+        stat_key = prefix_stat_key(prefix)
+        with self._lock:
+            cached = self._prefix_specs.get(prefix)
+            if cached is not None and cached[0] == stat_key:
+                return cached[1]
+
+        spec = Checkpoint.from_prefix(prefix=prefix, uuid="").env_checkpoint.environment
+        with self._lock:
+            self._prefix_specs[prefix] = (stat_key, spec)
+        return spec
+
+    def _get_park(self, url: str) -> Park:
+        with self._lock:
+            if url not in self._parks:
+                self._parks[url] = Park(url)
+            return self._parks[url]
+
+    def save(self, prefix: str, tags: List[str] | None = None) -> str:
+        env_uuid = short_uuid()
+        if not tags:
+            tags = [env_uuid]
+        env_checkpoint = environment.EnvironmentCheckpoint(
+            environment=self._get_prefix_spec(prefix).model_copy(deep=True),
+            timestamp=str(datetime.datetime.now(datetime.UTC)),
+            uuid=env_uuid,
+            tags=tags,
+        )
+        self.data_dir.save_environment_checkpoint(env_checkpoint, prefix)
+        with self._lock:
+            self._checkpoints.setdefault(prefix, {})[env_uuid] = env_checkpoint
+        return env_uuid
+
+    def delete(self, prefix: str, rev: str):
+        self.data_dir.delete_environment_checkpoint(prefix, rev)
+        with self._lock:
+            self._checkpoints.get(prefix, {}).pop(rev, None)
+
+    def list(self, prefix: str) -> List[Dict]:
+        index = self.data_dir.get_checkpoint_index(prefix)
+        points = [
+            {"uuid": uuid, "tags": entry["tags"], "timestamp": entry["timestamp"]}
+            for uuid, entry in index.items()
+        ]
+        points.sort(key=lambda x: x["timestamp"], reverse=True)
+        return points
+
+    def diff(self, prefix: str, rev: str) -> Dict[str, List[str]]:
+        current = Checkpoint(
+            env_checkpoint=environment.EnvironmentCheckpoint(
+                environment=self._get_prefix_spec(prefix), timestamp="", uuid="", tags=[],
+            ),
+            prefix=prefix,
+        )
+        added, removed = current.diff_checkpoint(self._get_checkpoint(prefix, rev))
+        return {
+            "added": [str(pkg) for pkg in added],
+            "removed": [str(pkg) for pkg in removed],
+        }
+
+    def show(self, prefix: str, rev: str | None = None) -> List[str]:
+        if rev is None:
+            packages = self._get_prefix_spec(prefix).packages
+        else:
+            packages = self._get_checkpoint(prefix, rev).environment.packages
+        return [str(pkg) for pkg in packages]
+
+    def status(self, prefix: str, rev: str | None = None) -> Dict:
+        """Whether the prefix is clean vs a revision, defaults to the latest"""
+        # the index has the build hash of every checkpoint, no need to
+        # load and parse them
+        index = self.data_dir.get_checkpoint_index(prefix)
+        if rev is None:
+            if not index:
+                return {"clean": False, "rev": None}
+            rev = max(index, key=lambda uuid: index[uuid]["timestamp"])
+        if rev in index:
+            target_hash = index[rev]["build_hash"]
+        else:
+            try:
+                target_hash = self._get_checkpoint(prefix, rev).environment.fingerprint()
+            except ValueError:
+                return {"clean": False, "rev": None}
+
+        stat_key = prefix_stat_key(prefix)
+        with self._lock:
+            cached = self._prefix_specs.get(prefix)
+        if cached is not None and cached[0] == stat_key:
+            current_hash = cached[1].metadata.build_hash
+        else:
+            current_hash = prefix_fingerprint(prefix)
+
+        return {"clean": current_hash == target_hash, "rev": rev}
+
+    def push(self, park_url: str, namespace: str, environment: str, tag: str, prefix: str, rev: str):
+        data = self._get_checkpoint(prefix, rev).model_dump()
+        self._get_park(park_url).push(namespace, environment, tag, data)
+
+    def pull(self, park_url: str, namespace: str, environment: str, tag: str, prefix: str):
+        checkpoint_data = self._get_park(park_url).pull(namespace, environment, tag)
+        chck = Checkpoint.from_checkpoint_dict(checkpoint_data=checkpoint_data, prefix=prefix)
+        chck.save()
@@ -1,7 +1,17 @@
+import contextlib
 import hashlib
+import os
 from pathlib import Path
+import tempfile
 import uuid
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - windows
+    fcntl = None
+
+
+TEMP_FILE_SUFFIX = ".tmp"
 
 def hash_string(s: str) -> str:
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
@@ -15,3 +25,102 @@ def ensure_dir(s: str):
 
 def short_uuid() -> str:
     return uuid.uuid4().hex[:8]
+
+
+@contextlib.contextmanager
+def file_lock(path: str):
+    """Hold an exclusive advisory lock on `path` for the duration of the context
+
+    On platforms without `fcntl` this is a no-op.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # closing the fd releases the lock
+        os.close(fd)
+
+
+def write_temp_file(path: str, contents: str, fsync: bool = True) -> str:
+    """Write `contents` to a new temp file next to `path`, returns its path
+
+    The temp file name starts with a "." and ends with `TEMP_FILE_SUFFIX`
+    so it is never mistaken for the target. Rename it over `path` with `os.replace` to publish it.
+    """
+    target_dir = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(
+        dir=target_dir, prefix=f".{os.path.basename(path)}.", suffix=TEMP_FILE_SUFFIX
+    )
+    try:
+        with os.fdopen(fd, "w") as file:
+            file.write(contents)
+            file.flush()
+            if fsync:
+                os.fsync(file.fileno())
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+def atomic_write(path: str, contents: str, fsync: bool = True):
+    """Write `contents` to `path` so readers see either the old or new file
+
+    The data is written to a temp file next to the target and renamed
+    over it, so a crash part way through never leaves a truncated file.
+    """
+    tmp_path = write_temp_file(path, contents, fsync=fsync)
+    try:
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+
+    if fsync:
+        # persist the rename itself, not just the file contents
+        fsync_file(os.path.dirname(path) or ".")
+
+
+def fsync_file(path: str):
+    """Flush a file or directory to disk, ignoring unsupported filesystems"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def prefix_stat_key(prefix: str) -> str:
+    """Cheap hash of the on-disk package metadata of a prefix
+
+    Only stats files (no parsing), so it is fast enough to run on every
+    call. It changes whenever a conda or pip package is added, removed
+    or rewritten in the prefix.
+    """
+    entries = []
+    meta_dirs = [os.path.join(prefix, "conda-meta")]
+    meta_dirs += [str(p) for p in Path(prefix).glob("lib/python*/site-packages")]
+    meta_dirs += [os.path.join(prefix, "Lib", "site-packages")]
+    for meta_dir in meta_dirs:
+        try:
+            scanned = os.scandir(meta_dir)
+        except OSError:
+            continue
+        with scanned:
+            for entry in scanned:
+                if meta_dir.endswith("site-packages") and not entry.name.endswith(
+                    (".dist-info", ".egg-info")
+                ):
+                    continue
+                stat = entry.stat()
+                entries.append(f"{entry.path}:{stat.st_mtime_ns}:{stat.st_size}")
+    return hash_string("\n".join(sorted(entries)))
@@ -7,8 +7,7 @@ import asyncio
 from rich.table import Table
 import rich
 
-from dof._src.checkpoint import Checkpoint
-from dof._src.data.local import LocalData
+from dof._src.daemon import get_service
 from dof._src.utils import short_uuid
 from dof._src.constants import SupportedExportFormats
 
@@ -42,12 +41,7 @@ def save(
     else:
         prefix = os.path.abspath(prefix)
     
-    env_uuid = short_uuid()
-    if tags is None:
-        tags = [env_uuid]
-
-    chck = Checkpoint.from_prefix(prefix=prefix, tags=tags, uuid=env_uuid)
-    chck.save()
+    get_service().save(prefix=prefix, tags=tags)
 
 
 @checkpoint_command.command()
@@ -66,8 +60,9 @@ def delete(
         prefix = os.environ.get("CONDA_PREFIX")
     else:
         prefix = os.path.abspath(prefix)
-    data = LocalData()
-    data.delete_environment_checkpoint(prefix=prefix, uuid=rev)
+
+    # through the daemon if it's running, so it forgets the revision too
+    get_service().delete(prefix=prefix, rev=rev)
 
 
 @checkpoint_command.command()
@@ -79,14 +74,13 @@ def list(
     ),
 ):
     """List all checkpoints for the current environment"""
-    data = LocalData()
     if prefix is None:
         prefix = os.environ.get("CONDA_PREFIX")
     else:
         prefix = os.path.abspath(prefix)
-    
-    checkpoints = data.get_environment_checkpoints(prefix=prefix)
-    checkpoints.sort(key=lambda x: x.timestamp, reverse=True)
+
+    # sorted newest first
+    checkpoints = get_service().list(prefix=prefix)
 
     table = Table(title="Checkpoints")
     table.add_column("uuid", justify="left", no_wrap=True)
@@ -94,7 +88,7 @@ def list(
     table.add_column("timestamp", justify="left", no_wrap=True)
 
     for point in checkpoints:
-        table.add_row(point.uuid, str(point.tags), point.timestamp)
+        table.add_row(point["uuid"], str(point["tags"]), point["timestamp"])
 
     rich.print(table)
 
@@ -109,8 +103,15 @@ def install(
         None,
         help="prefix to install"
     ),
+    mirror: str = typer.Option(
+        None,
+        help="install packages from this mirror dir instead of their channels"
+    ),
 ):
     """Install a previous revision of the environment"""
+    from dof._src.checkpoint import Checkpoint
+    from dof._src.mirror import mirror_channel_url
+
     if prefix is None:
         prefix = os.environ.get("CONDA_PREFIX")
     else:
@@ -129,9 +130,46 @@ def install(
         print(f"+ {pkg}")
 
     rev_checkpoint = Checkpoint.from_uuid(prefix=prefix, uuid=rev)
+    if mirror is not None:
+        rev_checkpoint = rev_checkpoint.with_channel(mirror_channel_url(mirror))
     asyncio.run(rev_checkpoint.install_with_rattler())
 
 
+@checkpoint_command.command()
+def clone(
+    ctx: typer.Context,
+    rev: str = typer.Option(
+        help="uuid of the revision to clone"
+    ),
+    to: str = typer.Option(
+        help="new prefix to create"
+    ),
+    prefix: str = typer.Option(
+        None,
+        help="prefix the revision belongs to"
+    ),
+):
+    """Create a new environment from a revision by linking existing package files"""
+    from dof._src.checkpoint import Checkpoint
+
+    if prefix is None:
+        prefix = os.environ.get("CONDA_PREFIX")
+    else:
+        prefix = os.path.abspath(prefix)
+    to = os.path.abspath(to)
+
+    if os.path.exists(os.path.join(to, "conda-meta")):
+        print(f"{to} is already an environment")
+        raise typer.Exit(code=1)
+
+    chck = Checkpoint.from_uuid(prefix=prefix, uuid=rev)
+    summary = chck.clone_to(to)
+    print(
+        f"cloned rev {rev} into {to}: {summary['cache']} linked from the package cache, "
+        f"{summary['prefix']} from existing environments, {summary['fetched']} downloaded"
+    )
+
+
 @checkpoint_command.command()
 def diff(
     ctx: typer.Context,
@@ -148,16 +186,53 @@ def diff(
         prefix = os.environ.get("CONDA_PREFIX")
     else:
         prefix = os.path.abspath(prefix)
-    env_uuid = short_uuid()
-    chck = Checkpoint.from_prefix(prefix=prefix, uuid=env_uuid)
-    packages_in_current_not_in_target, packages_in_target_not_in_current = chck.diff(rev)
+    result = get_service().diff(prefix=prefix, rev=rev)
 
     print(f"diff with rev {rev}")
-    for pkg in packages_in_current_not_in_target:
+    for pkg in result["added"]:
         print(f"+ {pkg}")
-    for pkg in packages_in_target_not_in_current:
+    for pkg in result["removed"]:
         print(f"- {pkg}")
 
+@checkpoint_command.command()
+def status(
+    ctx: typer.Context,
+    rev: str = typer.Option(
+        None,
+        help="uuid of the revision to compare against, defaults to the latest"
+    ),
+    prefix: str = typer.Option(
+        None,
+        help="prefix to check"
+    ),
+    exit_code: bool = typer.Option(
+        False,
+        help="exit with 1 if the environment is dirty"
+    ),
+):
+    """Check if the environment has changed since a revision"""
+    if prefix is None:
+        prefix = os.environ.get("CONDA_PREFIX")
+    else:
+        prefix = os.path.abspath(prefix)
+
+    result = get_service().status(prefix=prefix, rev=rev)
+    clean, target_rev = result["clean"], result["rev"]
+    if target_rev is None:
+        if rev is not None:
+            print(f"revision {rev} not found")
+            raise typer.Exit(code=1)
+        print("no checkpoints for this environment")
+        raise typer.Exit(code=1 if exit_code else 0)
+
+    if clean:
+        print(f"clean vs rev {target_rev}")
+    else:
+        print(f"dirty vs rev {target_rev}")
+        if exit_code:
+            raise typer.Exit(code=1)
+
+
 @checkpoint_command.command()
 def show(
     ctx: typer.Context,
@@ -176,13 +251,7 @@ def show(
     else:
         prefix = os.path.abspath(prefix)
 
-    if rev is None:
-        env_uuid = short_uuid()
-        chck = Checkpoint.from_prefix(prefix=prefix, uuid=env_uuid)
-    else:
-        chck = Checkpoint.from_uuid(prefix=prefix, uuid=rev)
-
-    for pkg in chck.list_packages():
+    for pkg in get_service().show(prefix=prefix, rev=rev):
         print(pkg)
 
 
@@ -206,6 +275,8 @@ def export(
     ] = ...
 ):
     """Export the revision to given format"""
+    from dof._src.checkpoint import Checkpoint
+
     if prefix is None:
         prefix = os.environ.get("CONDA_PREFIX")
     else:
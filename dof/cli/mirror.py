@@ -0,0 +1,72 @@
+import os
+import typer
+from typing import List
+from pathlib import Path
+
+import yaml
+
+
+mirror_command = typer.Typer(
+    add_completion=False,
+    no_args_is_help=True,
+    rich_markup_mode="rich",
+    context_settings={"help_option_names": ["-h", "--help"]},
+)
+
+
+@mirror_command.command()
+def build(
+    ctx: typer.Context,
+    out: str = typer.Option(
+        help="directory to write the mirror to"
+    ),
+    revs: List[str] = typer.Option(
+        None,
+        help="uuids of the revisions to mirror"
+    ),
+    files: List[str] = typer.Option(
+        None,
+        "--file",
+        help="checkpoint files or lockfiles to mirror"
+    ),
+    prefix: str = typer.Option(
+        None,
+        help="prefix the revisions belong to"
+    ),
+):
+    """Build an offline conda channel with the packages of some checkpoints
+
+    Use the output dir with `--mirror` on install, install-checkpoint and lock.
+    """
+    from dof._src.data.cached import get_data_backend
+    from dof._src.models import environment
+    from dof._src.mirror import build_mirror
+
+    if prefix is None:
+        prefix = os.environ.get("CONDA_PREFIX")
+    else:
+        prefix = os.path.abspath(prefix)
+
+    packages = []
+    data = get_data_backend()
+    for rev in revs or []:
+        checkpoint = data.get_environment_checkpoint(prefix, rev)
+        if checkpoint is None:
+            print(f"revision {rev} not found")
+            raise typer.Exit(code=1)
+        packages += checkpoint.environment.packages
+    for file in files or []:
+        file_data = yaml.safe_load(Path(file).read_text())
+        if "environment" in file_data:
+            file_data = file_data["environment"]
+        packages += environment.EnvironmentSpec.model_validate(file_data).packages
+
+    if not packages:
+        print("nothing to mirror, pass --revs or --file")
+        raise typer.Exit(code=1)
+
+    summary = build_mirror(packages, os.path.abspath(out))
+    print(
+        f"mirrored {summary['packages']} packages into {out} "
+        f"({summary['downloaded']} downloaded, {summary['reused']} already present)"
+    )
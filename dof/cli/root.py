@@ -5,10 +5,10 @@ import typer
 from typing_extensions import Annotated
 from pathlib import Path
 
-from dof._src.lock import lock_environment
-from dof._src.checkpoint import Checkpoint
-from dof._src.park.park import Park
+from dof._src.constants import InstallEngines
+from dof._src.daemon import get_service, serve as serve_daemon
 from dof.cli.checkpoint import checkpoint_command
+from dof.cli.mirror import mirror_command
 
 
 app = typer.Typer(
@@ -25,6 +25,13 @@ app.add_typer(
     rich_help_panel="Checkpoint",
 )
 
+app.add_typer(
+    mirror_command,
+    name="mirror",
+    help="build offline channels from checkpoints",
+    rich_help_panel="Mirror",
+)
+
 
 @app.command()
 def lock(
@@ -35,9 +42,17 @@ def lock(
         None,
         help="path to output lockfile"
     ),
+    mirror: str = typer.Option(
+        None,
+        help="solve against this mirror dir instead of the env file channels"
+    ),
 ):
     """Generate a lockfile"""
-    solved_env = lock_environment(path=env_file)
+    from dof._src.lock import lock_environment
+    from dof._src.mirror import mirror_channel_url
+
+    channel_override = mirror_channel_url(mirror) if mirror is not None else None
+    solved_env = lock_environment(path=env_file, channel_override=channel_override)
     
     # If no output is specified dump yaml output to stdout
     if output is None:
@@ -63,7 +78,6 @@ def push(
 ):
     """Push a checkpoint to a target"""
     park_url = os.environ.get("PARK_URL")
-    api = Park(park_url)
 
     namespace = target.split("/")[0]
     env_tag = target.split("/")[1]
@@ -75,10 +89,10 @@ def push(
     else:
         prefix = os.path.abspath(prefix)
 
-    chck = Checkpoint.from_uuid(prefix=prefix, uuid=rev)
-    data = chck.env_checkpoint.model_dump()
-
-    api.push(namespace, environment, tag, data)
+    get_service().push(
+        park_url=park_url, namespace=namespace, environment=environment,
+        tag=tag, prefix=prefix, rev=rev,
+    )
 
 
 @app.command()
@@ -94,22 +108,21 @@ def pull(
 ):
     """Push a checkpoint to a target"""
     park_url = os.environ.get("PARK_URL")
-    api = Park(park_url)
 
     namespace = target.split("/")[0]
     env_tag = target.split("/")[1]
     environment = env_tag.split(":")[0]
     tag = env_tag.split(":")[1]
 
-    checkpoint_data = api.pull(namespace, environment, tag)
-
     if prefix is None:
         prefix = os.environ.get("CONDA_PREFIX")
     else:
         prefix = os.path.abspath(prefix)
 
-    chck = Checkpoint.from_checkpoint_dict(checkpoint_data=checkpoint_data, prefix=prefix)
-    chck.save()
+    get_service().pull(
+        park_url=park_url, namespace=namespace, environment=environment,
+        tag=tag, prefix=prefix,
+    )
 
 
 @app.command()
@@ -118,7 +131,7 @@ def install_checkpoint(
         str,
         typer.Option(
             default=...,
-            help="full path to checkpoint file"
+            help="full path to checkpoint file or lockfile from `dof lock`"
         ),
     ] = ...,
     prefix: Annotated[
@@ -127,9 +140,62 @@ def install_checkpoint(
             default=...,
             help="prefix to install into"
         ),
-    ] = ...
+    ] = ...,
+    engine: InstallEngines = typer.Option(
+        InstallEngines.PIPELINE,
+        help="pipeline streams and links packages itself, rattler hands everything to rattler"
+    ),
+    summary: str = typer.Option(
+        None,
+        help="path to write a json summary of the install to (pipeline engine only)"
+    ),
+    mirror: str = typer.Option(
+        None,
+        help="install packages from this mirror dir instead of their channels"
+    ),
 ):
-    """Install a checkpoint file to a prefix"""
+    """Install a checkpoint file or lockfile to a prefix"""
+    from dof._src.checkpoint import Checkpoint
+    from dof._src.mirror import mirror_channel_url
+
+    if summary is not None and engine == InstallEngines.RATTLER:
+        print("--summary is only supported with --engine pipeline")
+        raise typer.Exit(code=1)
+
+    prefix = os.path.abspath(prefix)
     checkpoint_data = yaml.safe_load(Path(file).read_text())
-    chck = Checkpoint.from_checkpoint_dict(checkpoint_data=checkpoint_data, prefix=prefix)
-    asyncio.run(chck.install_with_rattler())
+    if "environment" in checkpoint_data:
+        chck = Checkpoint.from_checkpoint_dict(checkpoint_data=checkpoint_data, prefix=prefix)
+    else:
+        # lockfiles are a bare environment spec, no solve needed either way
+        chck = Checkpoint.from_lockfile_dict(lock_data=checkpoint_data, prefix=prefix)
+    if mirror is not None:
+        chck = chck.with_channel(mirror_channel_url(mirror))
+
+    # the pipeline only adds packages, let rattler work out what to
+    # remove when installing over an existing environment
+    if engine == InstallEngines.PIPELINE and os.path.isdir(os.path.join(prefix, "conda-meta")):
+        print(f"{prefix} is an existing environment, installing with rattler")
+        if summary is not None:
+            print(f"not writing a summary to {summary}, that needs the pipeline engine")
+        engine = InstallEngines.RATTLER
+
+    if engine == InstallEngines.PIPELINE:
+        chck.install_with_pipeline(summary_file=summary)
+    else:
+        asyncio.run(chck.install_with_rattler())
+
+
+@app.command()
+def serve(
+    socket: str = typer.Option(
+        None,
+        help="path of the unix socket to listen on, defaults to $DOF_DIR/dof.sock"
+    ),
+):
+    """Run a daemon that keeps dof state warm
+
+    While it is running the other dof commands talk to it instead of
+    loading everything from scratch.
+    """
+    serve_daemon(socket_path=socket)
@@ -0,0 +1,158 @@
+import os
+
+import pytest
+
+from dof._src.data.cached import PENDING_MARKER_PREFIX, CachedData
+from dof._src.data.local import LocalData
+from dof._src.data.remote import FilesystemRemoteData
+from dof._src.models import environment, package
+
+
+PREFIX = "/opt/envs/test"
+
+
+class CountingRemote(FilesystemRemoteData):
+    """Remote on a temp dir that counts how often it is read"""
+
+    def __init__(self, url: str):
+        super().__init__(url, fsync=False)
+        self.reads = 0
+        self.index_reads = 0
+        self.listings = 0
+
+    def get_environment_checkpoint(self, prefix, uuid):
+        self.reads += 1
+        return super().get_environment_checkpoint(prefix, uuid)
+
+    def list_checkpoint_uuids(self, prefix):
+        self.listings += 1
+        return super().list_checkpoint_uuids(prefix)
+
+    def get_checkpoint_index(self, prefix):
+        self.index_reads += 1
+        return super().get_checkpoint_index(prefix)
+
+
+def make_checkpoint(uuid: str, timestamp: str) -> environment.EnvironmentCheckpoint:
+    packages = [package.UrlCondaPackage(url=f"https://conda.anaconda.org/conda-forge/noarch/{uuid}-1.0-0.conda")]
+    return environment.EnvironmentCheckpoint(
+        environment=environment.EnvironmentSpec(
+            packages=packages,
+            metadata=environment.EnvironmentMetadata(
+                platform="linux-64", channels=[], build_hash=package.fingerprint(packages),
+            ),
+        ),
+        timestamp=timestamp,
+        uuid=uuid,
+        tags=[uuid],
+    )
+
+
+@pytest.fixture
+def remote(tmp_path):
+    return CountingRemote(str(tmp_path / "remote"))
+
+
+def make_cache(tmp_path, remote, max_entries=3, index_ttl=60.0) -> CachedData:
+    local = LocalData(str(tmp_path / "local"), fsync=False)
+    return CachedData(local, remote, max_entries=max_entries, batch_delay=0, index_ttl=index_ttl)
+
+
+def local_uuids(cache: CachedData) -> set:
+    return set(cache.local.list_checkpoint_uuids(PREFIX))
+
+
+def test_saves_are_uploaded_and_cache_is_trimmed(tmp_path, remote):
+    cache = make_cache(tmp_path, remote)
+    for i in range(6):
+        cache.save_environment_checkpoint(make_checkpoint(f"u{i}", f"2024-01-0{i + 1}"), PREFIX)
+    cache.flush()
+
+    assert set(remote.list_checkpoint_uuids(PREFIX)) == {f"u{i}" for i in range(6)}
+    env_dir = cache.local._get_env_dir(PREFIX)
+    assert not [f for f in os.listdir(env_dir) if f.startswith(PENDING_MARKER_PREFIX)]
+    assert len(local_uuids(cache)) == 3
+
+
+def test_saves_dont_touch_the_remote(tmp_path, remote):
+    cache = make_cache(tmp_path, remote, max_entries=1)
+    cache._enqueue = lambda prefix, uuid: None
+    for i in range(3):
+        cache.save_environment_checkpoint(make_checkpoint(f"u{i}", f"2024-01-0{i + 1}"), PREFIX)
+    assert remote.listings == 0
+    assert remote.index_reads == 0
+    assert len(local_uuids(cache)) == 3
+
+
+def test_list_does_not_refill_the_cache(tmp_path, remote):
+    remote.save_environment_checkpoints(
+        [make_checkpoint(f"u{i}", f"2024-01-0{i + 1}") for i in range(7)], PREFIX
+    )
+    cache = make_cache(tmp_path, remote)
+    cache.save_environment_checkpoint(make_checkpoint("u7", "2024-01-08"), PREFIX)
+    cache.flush()
+    cached = local_uuids(cache)
+
+    for _ in range(3):
+        index = cache.get_checkpoint_index(PREFIX)
+        assert set(index) == {f"u{i}" for i in range(8)}
+        assert index["u7"]["tags"] == ["u7"]
+    assert remote.reads == 0
+    assert local_uuids(cache) == cached
+
+    reads = remote.reads
+    assert cache.get_environment_checkpoint(PREFIX, "u7").uuid == "u7"
+    assert remote.reads == reads
+
+
+def test_remote_index_is_reused_within_ttl(tmp_path, remote):
+    remote.save_environment_checkpoint(make_checkpoint("u0", "2024-01-01"), PREFIX)
+    cache = make_cache(tmp_path, remote)
+    cache.list_checkpoint_uuids(PREFIX)
+    cache.list_checkpoint_uuids(PREFIX)
+    assert remote.index_reads == 1
+
+    expired = make_cache(tmp_path, remote, index_ttl=0)
+    expired.list_checkpoint_uuids(PREFIX)
+    assert remote.index_reads == 2
+
+
+def test_remote_read_is_cached_without_evicting(tmp_path, remote):
+    remote.save_environment_checkpoints(
+        [make_checkpoint(f"u{i}", f"2024-01-0{i + 1}") for i in range(5)], PREFIX
+    )
+    cache = make_cache(tmp_path, remote, max_entries=2)
+    for i in range(5):
+        cache.get_environment_checkpoint(PREFIX, f"u{i}")
+    assert local_uuids(cache) == {f"u{i}" for i in range(5)}
+
+    reads = remote.reads
+    cache.get_environment_checkpoint(PREFIX, "u0")
+    assert remote.reads == reads
+
+
+def test_pending_uploads_are_retried(tmp_path, remote):
+    crashed = make_cache(tmp_path, remote)
+    # a save whose upload never happened, eg. the process was killed
+    crashed._enqueue = lambda prefix, uuid: None
+    crashed.save_environment_checkpoint(make_checkpoint("u0", "2024-01-01"), PREFIX)
+    assert remote.list_checkpoint_uuids(PREFIX) == []
+
+    cache = make_cache(tmp_path, remote)
+    cache.save_environment_checkpoint(make_checkpoint("u1", "2024-01-02"), PREFIX)
+    cache.flush()
+    assert set(remote.list_checkpoint_uuids(PREFIX)) == {"u0", "u1"}
+
+
+def test_marker_is_written_before_the_checkpoint(tmp_path, remote):
+    cache = make_cache(tmp_path, remote)
+
+    def crash(checkpoints, prefix):
+        raise OSError("disk full")
+
+    cache.local.save_environment_checkpoints = crash
+    with pytest.raises(OSError):
+        cache.save_environment_checkpoint(make_checkpoint("u0", "2024-01-01"), PREFIX)
+    assert os.path.exists(cache._marker_file(PREFIX, "u0"))
+    # nothing was saved, so there is nothing to upload
+    assert cache._find_pending() == []
@@ -0,0 +1,69 @@
+import os
+import warnings
+
+import pytest
+
+from dof._src.data.local import STALE_TEMP_FILE_SECONDS, LocalData
+from dof._src.models import environment, package
+
+
+PREFIX = "/opt/envs/test"
+
+
+def make_checkpoint(uuid: str, timestamp: str) -> environment.EnvironmentCheckpoint:
+    packages = [package.UrlCondaPackage(url=f"https://conda.anaconda.org/conda-forge/noarch/{uuid}-1.0-0.conda")]
+    return environment.EnvironmentCheckpoint(
+        environment=environment.EnvironmentSpec(
+            packages=packages,
+            metadata=environment.EnvironmentMetadata(
+                platform="linux-64", channels=[], build_hash=package.fingerprint(packages),
+            ),
+        ),
+        timestamp=timestamp,
+        uuid=uuid,
+        tags=[uuid],
+    )
+
+
+@pytest.fixture
+def data(tmp_path):
+    return LocalData(str(tmp_path), fsync=False)
+
+
+def test_index_follows_saves_and_deletes(data):
+    data.save_environment_checkpoints(
+        [make_checkpoint("u0", "2024-01-01"), make_checkpoint("u1", "2024-01-02")], PREFIX
+    )
+    data.delete_environment_checkpoint(PREFIX, "u0")
+    index = data.get_checkpoint_index(PREFIX)
+    assert list(index) == ["u1"]
+    assert index["u1"]["build_hash"] == make_checkpoint("u1", "").environment.fingerprint()
+
+
+def test_corrupt_checkpoints_are_only_parsed_once(data):
+    data.save_environment_checkpoint(make_checkpoint("u0", "2024-01-01"), PREFIX)
+    with open(os.path.join(data._get_env_dir(PREFIX), "broken"), "w") as file:
+        file.write("{not: [valid")
+
+    with pytest.warns(UserWarning, match="corrupt"):
+        assert list(data.get_checkpoint_index(PREFIX)) == ["u0"]
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert list(data.get_checkpoint_index(PREFIX)) == ["u0"]
+
+
+def test_stale_temp_files_are_removed(data):
+    data.save_environment_checkpoint(make_checkpoint("u0", "2024-01-01"), PREFIX)
+    env_dir = data._get_env_dir(PREFIX)
+    stale = os.path.join(env_dir, ".u1.abc.tmp")
+    fresh = os.path.join(env_dir, ".u2.def.tmp")
+    for path in (stale, fresh):
+        with open(path, "w") as file:
+            file.write("half written")
+    old = os.stat(stale).st_mtime - STALE_TEMP_FILE_SECONDS - 1
+    os.utime(stale, (old, old))
+
+    assert list(data.get_checkpoint_index(PREFIX)) == ["u0"]
+    assert not os.path.exists(stale)
+    # may still belong to a writer that is running right now
+    assert os.path.exists(fresh)